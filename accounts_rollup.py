@@ -0,0 +1,160 @@
+import calendar
+import datetime
+import os
+import sqlite3
+from contextlib import closing
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS account_counts (
+  period TEXT NOT NULL,
+  chain TEXT NOT NULL,
+  date TEXT NOT NULL,
+  factory TEXT NOT NULL,
+  num_accounts INTEGER NOT NULL,
+  PRIMARY KEY (period, chain, date, factory)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS chain_watermarks (
+  period TEXT NOT NULL,
+  chain TEXT NOT NULL,
+  block_time TEXT NOT NULL,
+  PRIMARY KEY (period, chain)
+);
+'''
+
+
+def period_start(day, period):
+  """Truncates a date like Snowflake's DATE_TRUNC (weeks start on Monday)."""
+  if period == 'day':
+    return day
+  if period == 'week':
+    return day - datetime.timedelta(days=day.weekday())
+  if period == 'month':
+    return day.replace(day=1)
+  if period == 'quarter':
+    return day.replace(month=day.month - (day.month - 1) % 3, day=1)
+  if period == 'year':
+    return day.replace(month=1, day=1)
+  raise ValueError(f"Unsupported period: {period}")
+
+
+def months_before(day, months):
+  year, month = divmod(day.year * 12 + day.month - 1 - months, 12)
+  last_day = calendar.monthrange(year, month + 1)[1]
+  return day.replace(year=year, month=month + 1, day=min(day.day, last_day))
+
+
+class AccountsRollup:
+  """Distinct active accounts per (period, factory, chain) kept in SQLite.
+
+  ``fetch(period, since)`` returns rows with DATE, FACTORY_NAME, CHAIN
+  ('all' for every chain together), NUM_ACCOUNTS and LAST_BLOCK_TIME for all
+  buckets from the one holding ``since`` onwards, or for the whole window
+  when ``since`` is None. Since user ops only ever get appended, buckets
+  before the watermark are final. The watermark is kept per chain, as chains
+  load at different paces; each refresh recomputes only the buckets from the
+  lowest chain's latest BLOCK_TIME (less ``overlap`` seconds for late rows)
+  and swaps them in, so distinct counts stay exact without storing senders.
+  A chain trailing the newest one by more than ``stale_after`` seconds has
+  stopped loading and no longer holds the refreshes back.
+  """
+
+  def __init__(self, path, fetch, periods=('week', 'month'), months=24,
+               overlap=3600, stale_after=7 * 86400):
+    self.path = path
+    self.fetch = fetch
+    self.periods = tuple(periods)
+    self.months = months
+    self.overlap = overlap
+    self.stale_after = stale_after
+
+  def _connect(self):
+    conn = sqlite3.connect(self.path, timeout=30)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.executescript(SCHEMA)
+    return conn
+
+  def _watermarks(self, conn, period):
+    return dict(conn.execute(
+      'SELECT chain, block_time FROM chain_watermarks WHERE period = ?',
+      (period,)).fetchall())
+
+  def _watermark(self, conn, period):
+    return self._earliest(self._watermarks(conn, period))
+
+  def _earliest(self, watermarks):
+    times = {datetime.datetime.fromisoformat(block_time): block_time
+             for block_time in watermarks.values()}
+    if not times:
+      return None
+    cutoff = max(times) - datetime.timedelta(seconds=self.stale_after)
+    return times[min(time for time in times if time >= cutoff)]
+
+  def watermark(self, period):
+    if period not in self.periods or not os.path.exists(self.path):
+      return None
+    with closing(self._connect()) as conn:
+      return self._watermark(conn, period)
+
+  def window_start(self, period, today=None):
+    # Same window as the live query: buckets overlapping the last `months`.
+    today = today or datetime.date.today()
+    cutoff = months_before(period_start(today, period), self.months)
+    return period_start(cutoff, period).isoformat()
+
+  def read(self, period, chain):
+    """Returns the accounts chart rows, or None if ``period`` isn't built."""
+    if period not in self.periods or not os.path.exists(self.path):
+      return None
+    with closing(self._connect()) as conn:
+      if self._watermark(conn, period) is None:
+        return None
+      rows = conn.execute('''
+      SELECT date, factory, num_accounts
+      FROM account_counts
+      WHERE period = ? AND chain = ? AND date >= ?
+      ORDER BY date, factory
+      ''', (period, chain.lower(), self.window_start(period))).fetchall()
+    return [{'DATE': date, 'FACTORY_NAME': factory, 'NUM_ACCOUNTS': count}
+            for date, factory, count in rows]
+
+  def refresh(self, period):
+    """Brings ``period`` up to date and returns the number of rows fetched."""
+    watermarks = {}
+    if period in self.periods and os.path.exists(self.path):
+      with closing(self._connect()) as conn:
+        watermarks = self._watermarks(conn, period)
+    watermark = self._earliest(watermarks)
+    since = None
+    if watermark is not None:
+      since = (datetime.datetime.fromisoformat(watermark) -
+               datetime.timedelta(seconds=self.overlap))
+    rows = self.fetch(period, since)
+    with closing(self._connect()) as conn, conn:
+      if since is None:
+        conn.execute('DELETE FROM account_counts WHERE period = ?', (period,))
+      elif rows:
+        conn.execute('DELETE FROM account_counts WHERE period = ? AND date >= ?',
+                     (period, min(row['DATE'] for row in rows)))
+      conn.executemany('INSERT INTO account_counts VALUES (?, ?, ?, ?, ?)', [
+        (period, row['CHAIN'].lower(), row['DATE'], row['FACTORY_NAME'],
+         int(row['NUM_ACCOUNTS'])) for row in rows
+      ])
+      conn.execute('DELETE FROM account_counts WHERE period = ? AND date < ?',
+                   (period, self.window_start(period)))
+      if since is None:
+        conn.execute('DELETE FROM chain_watermarks WHERE period = ?',
+                     (period,))
+        watermarks = {}
+      for row in rows:
+        chain = row['CHAIN'].lower()
+        if chain != 'all':
+          watermarks[chain] = max(watermarks.get(chain, ''),
+                                  _isoformat(row['LAST_BLOCK_TIME']))
+      conn.executemany('INSERT OR REPLACE INTO chain_watermarks VALUES (?, ?, ?)',
+                       [(period, chain, block_time)
+                        for chain, block_time in watermarks.items()])
+    return len(rows)
+
+
+def _isoformat(value):
+  return value.isoformat() if hasattr(value, 'isoformat') else str(value)
@@ -0,0 +1,120 @@
+import collections
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+import click
+import requests
+
+from bench.run import summarize
+
+
+def load(capture):
+  entries = [json.loads(line) for line in capture if line.strip()]
+  entries.sort(key=lambda entry: entry['ts'])
+  return entries
+
+
+@click.command()
+@click.argument('capture', type=click.File())
+@click.option('--url', default='http://127.0.0.1:8081', show_default=True,
+              help='Base URL of the server to replay against.')
+@click.option('--speed', default=1.0, show_default=True,
+              help='Playback rate relative to the capture; 0 sends as fast '
+                   'as the workers allow.')
+@click.option('--concurrency', default=16, show_default=True,
+              help='Requests in flight at most.')
+@click.option('--api-password', envvar='API_PASSWORD', default=None,
+              help='Sent as X-API-Password.')
+@click.option('--timeout', default=60.0, show_default=True)
+@click.option('--output', type=click.Path(dir_okay=False), default=None,
+              help='Also write the summary as JSON here.')
+def replay(capture, url, speed, concurrency, api_password, timeout, output):
+  """Re-issue captured traffic and report latency per route.
+
+  CAPTURE is a file written with TRAFFIC_CAPTURE_PATH set. Requests keep
+  their original spacing (scaled by --speed); the cache column is the share
+  of responses whose X-Cache header says local or redis. Latency counts
+  from each request's scheduled send time, so time spent waiting for a free
+  worker is included (with --speed 0, from when a worker picks it up).
+  """
+  entries = load(capture)
+  if not entries:
+    raise click.ClickException('capture is empty')
+  headers = {'X-API-Password': api_password} if api_password else {}
+  local = threading.local()
+  lock = threading.Lock()
+  latencies = collections.defaultdict(list)
+  errors = collections.Counter()
+  hits = collections.Counter()
+
+  def send(entry, offset):
+    if not hasattr(local, 'session'):
+      local.session = requests.Session()
+    target = f"{url.rstrip('/')}{entry['route']}"
+    if entry.get('args'):
+      target += '?' + urlencode(entry['args'])
+    start = time.perf_counter() if offset is None else started + offset
+    try:
+      response = local.session.get(target, headers=headers, timeout=timeout)
+      failed = response.status_code >= 400
+      cache = response.headers.get('X-Cache')
+    except requests.RequestException:
+      failed, cache = True, None
+    elapsed = time.perf_counter() - start
+    with lock:
+      latencies[entry['route']].append(elapsed)
+      if failed:
+        errors[entry['route']] += 1
+      if cache in ('local', 'redis'):
+        hits[entry['route']] += 1
+
+  first = entries[0]['ts']
+  started = time.perf_counter()
+  with ThreadPoolExecutor(max_workers=concurrency) as executor:
+    for entry in entries:
+      offset = None
+      if speed > 0:
+        offset = (entry['ts'] - first) / speed
+        delay = offset - (time.perf_counter() - started)
+        if delay > 0:
+          time.sleep(delay)
+      executor.submit(send, entry, offset)
+  duration = time.perf_counter() - started
+
+  def stats(samples, failed, hit):
+    return dict(summarize(samples), errors=failed,
+                cache_hit_ratio=round(hit / len(samples), 3))
+
+  routes = {route: stats(samples, errors[route], hits[route])
+            for route, samples in sorted(latencies.items())}
+  everything = [value for samples in latencies.values() for value in samples]
+  report = {
+    'capture': capture.name,
+    'url': url,
+    'speed': speed,
+    'concurrency': concurrency,
+    'duration_seconds': round(duration, 3),
+    'throughput_rps': round(len(everything) / duration, 1),
+    'overall': stats(everything, sum(errors.values()), sum(hits.values())),
+    'routes': routes,
+  }
+
+  click.echo(f"{'route':32} {'n':>6} {'p50':>9} {'p95':>9} {'p99':>9} "
+             f"{'errors':>7} {'cached':>7}")
+  for route, row in list(routes.items()) + [('overall', report['overall'])]:
+    click.echo(f"{route:32} {row['n']:>6} {row['p50']:>9.1f} "
+               f"{row['p95']:>9.1f} {row['p99']:>9.1f} {row['errors']:>7} "
+               f"{row['cache_hit_ratio']:>7.0%}")
+  click.echo(f"{report['throughput_rps']} req/s over "
+             f"{report['duration_seconds']} s")
+  if output:
+    with open(output, 'w') as f:
+      f.write(json.dumps(report, indent=2) + '\n')
+
+
+if __name__ == '__main__':
+  sys.exit(replay())
@@ -0,0 +1,281 @@
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+
+from bench import standin
+
+
+def percentile(values, q):
+  values = sorted(values)
+  if not values:
+    return None
+  index = min(len(values) - 1, max(0, round(q / 100 * (len(values) - 1))))
+  return values[index]
+
+
+def summarize(seconds):
+  ms = [value * 1000 for value in seconds]
+  return {
+    'n': len(ms),
+    'mean': round(statistics.fmean(ms), 3),
+    'p50': round(percentile(ms, 50), 3),
+    'p95': round(percentile(ms, 95), 3),
+    'p99': round(percentile(ms, 99), 3),
+    'max': round(max(ms), 3),
+  }
+
+
+def git_commit():
+  try:
+    return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True,
+                          text=True, check=True).stdout.strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+
+class Bench:
+  """Times one app instance wired to the stand-in warehouse."""
+
+  def __init__(self, main, headers):
+    self.main = main
+    self.client = main.app.test_client()
+    self.headers = headers
+
+  def reset(self, tables=True):
+    # Cold: no response in Redis or worker memory, and with `tables` no
+    # whole-table copies either, so every query goes to the warehouse.
+    self.main.redis_client.flushall()
+    self.main.response_cache.local.clear()
+    if tables:
+      self.main.table_cache._tables.clear()
+
+  def get(self, url, client=None):
+    start = time.perf_counter()
+    response = (client or self.client).get(url, headers=self.headers)
+    elapsed = time.perf_counter() - start
+    if response.status_code != 200:
+      raise click.ClickException(
+        f"{url} returned {response.status_code}: {response.get_data()[:200]}")
+    return elapsed, response
+
+  def cold(self, url, repeat, tables=True):
+    samples = []
+    for _ in range(repeat):
+      self.reset(tables=tables)
+      elapsed, response = self.get(url)
+      samples.append(elapsed)
+    return samples, response
+
+  def peak_memory(self, url):
+    self.reset()
+    tracemalloc.start()
+    try:
+      self.get(url)
+      return tracemalloc.get_traced_memory()[1]
+    finally:
+      tracemalloc.stop()
+
+  def throughput(self, url, threads, requests):
+    self.get(url)
+    local = threading.local()
+
+    def hit(_):
+      if not hasattr(local, 'client'):
+        local.client = self.main.app.test_client()
+      return self.get(url, local.client)[0]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+      samples = list(executor.map(hit, range(requests)))
+    return requests / (time.perf_counter() - start), samples
+
+  def run(self, url, repeat, hits, threads, requests):
+    cold, response = self.cold(url, repeat)
+    miss, _ = self.cold(url, repeat, tables=False)
+    warm = [self.get(url)[0] for _ in range(hits)]
+    rps, concurrent = self.throughput(url, threads, requests)
+    return {
+      'url': url,
+      'response_bytes': len(response.get_data()),
+      'cold_ms': summarize(cold),
+      'miss_ms': summarize(miss),
+      'hit_ms': summarize(warm),
+      'concurrent_hit_ms': summarize(concurrent),
+      'throughput_rps': round(rps, 1),
+      'peak_memory_bytes': self.peak_memory(url),
+      'cold_server_timing': response.headers.get('Server-Timing'),
+    }
+
+
+@click.group()
+def cli():
+  """Offline benchmarks against a DuckDB stand-in for Snowflake."""
+
+
+@cli.command()
+@click.option('--route', 'routes', multiple=True,
+              help='Route to benchmark (repeatable). Defaults to all.')
+@click.option('--chain', 'chains', multiple=True, default=['all', 'base'],
+              show_default=True, help='chain values to request.')
+@click.option('--timeframe', 'timeframes', multiple=True, default=['week'],
+              show_default=True, help='timeframe values to request.')
+@click.option('--weeks', default=104, show_default=True,
+              help='Weekly periods per series table (months scale with it).')
+@click.option('--names', default=20, show_default=True,
+              help='Distinct names (bundlers, apps, ...) per chart.')
+@click.option('--userops', default=200000, show_default=True,
+              help='Rows in ERC4337_ALL_USEROPS.')
+@click.option('--accounts', default=20000, show_default=True,
+              help='Rows in ERC4337_ALL_ACCOUNT_DEPLOYMENTS.')
+@click.option('--latency', default=0.0, show_default=True,
+              help='Seconds added to every query as warehouse round trip.')
+@click.option('--repeat', default=3, show_default=True,
+              help='Cold and miss samples per URL.')
+@click.option('--hits', default=200, show_default=True,
+              help='Sequential warm hits per URL.')
+@click.option('--threads', default=8, show_default=True,
+              help='Threads for the throughput run.')
+@click.option('--requests', 'requests_', default=1000, show_default=True,
+              help='Warm hits per URL for the throughput run.')
+@click.option('--output', type=click.Path(dir_okay=False), default=None,
+              help='Write results as JSON here instead of stdout.')
+def run(routes, chains, timeframes, weeks, names, userops, accounts, latency,
+        repeat, hits, threads, requests_, output):
+  """Measure cold, miss and hit latency, throughput and peak memory.
+
+  cold starts with empty Redis, response and table caches; miss only drops
+  cached responses, so tables come from worker memory.
+  """
+  seeded = time.perf_counter()
+  standin.install(latency=latency, weeks=weeks, names=names,
+                  userops=userops, accounts=accounts)
+  seeded = time.perf_counter() - seeded
+  import main
+
+  bench = Bench(main, {'X-API-Password': main.API_PASSWORD})
+  results = []
+  for path in routes or list(main.ROUTE_PARAMS):
+    accepted = main.ROUTE_PARAMS[path]
+    for chain in chains:
+      for timeframe in timeframes if 'timeframe' in accepted else [None]:
+        params = {'chain': chain, 'timeframe': timeframe}
+        query = '&'.join(f"{name}={value}" for name, value in params.items()
+                         if value is not None)
+        url = f"{path}?{query}"
+        click.echo(f"benchmarking {url}", err=True)
+        results.append(dict(bench.run(url, repeat, hits, threads, requests_),
+                            route=path, params=params))
+
+  report = {
+    'meta': {
+      'commit': git_commit(),
+      'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+      'python': platform.python_version(),
+      'platform': platform.platform(),
+      'seed_seconds': round(seeded, 3),
+      'scale': {'weeks': weeks, 'names': names, 'userops': userops,
+                'accounts': accounts, 'latency': latency},
+      'settings': {'repeat': repeat, 'hits': hits, 'threads': threads,
+                   'requests': requests_},
+    },
+    'results': results,
+  }
+  text = json.dumps(report, indent=2)
+  if output:
+    with open(output, 'w') as f:
+      f.write(text + '\n')
+  else:
+    click.echo(text)
+
+
+@cli.command()
+@click.argument('baseline', type=click.File())
+@click.argument('candidate', type=click.File())
+@click.option('--metric', default='p50', show_default=True,
+              help='Latency statistic to compare.')
+def compare(baseline, candidate, metric):
+  """Compare two result files from `run` URL by URL."""
+  before = {result['url']: result for result in json.load(baseline)['results']}
+  after = {result['url']: result for result in json.load(candidate)['results']}
+  click.echo(f"{'url':48} {'cold':>16} {'miss':>16} {'hit':>16} {'rps':>16}")
+  for url in sorted(before.keys() & after.keys()):
+    old, new = before[url], after[url]
+    cells = []
+    for key in ('cold_ms', 'miss_ms', 'hit_ms'):
+      cells.append(change(old[key][metric], new[key][metric]))
+    cells.append(change(old['throughput_rps'], new['throughput_rps']))
+    click.echo(f"{url:48} " + ' '.join(f"{cell:>16}" for cell in cells))
+
+
+@cli.command('check-rollup')
+@click.option('--userops', default=20000, show_default=True,
+              help='Rows in ERC4337_ALL_USEROPS.')
+@click.option('--accounts', default=2000, show_default=True,
+              help='Rows in ERC4337_ALL_ACCOUNT_DEPLOYMENTS.')
+def check_rollup(userops, accounts):
+  """Check incremental rollup refreshes against the live accounts chart.
+
+  An op exactly at the start of the bucket each incremental refresh
+  recomputes is seeded before the first refresh, more ops are appended
+  after it, and every chain and timeframe must then match the live query.
+  """
+  warehouse = standin.install(userops=userops, accounts=accounts)
+  import main
+  from accounts_rollup import AccountsRollup, period_start
+
+  # A separate rollup, so the app's own stays unbuilt and answers live.
+  rollup = AccountsRollup(
+    os.path.join(tempfile.mkdtemp(prefix='bench-'), 'accounts_rollup.sqlite3'),
+    main.fetch_account_counts, periods=main.accounts_rollup.periods)
+  since = warehouse.latest_userop() - datetime.timedelta(seconds=rollup.overlap)
+  warehouse.add_userops([
+    datetime.datetime.combine(period_start(since.date(), period),
+                              datetime.time())
+    for period in rollup.periods])
+  for period in rollup.periods:
+    rollup.refresh(period)
+  now = datetime.datetime.now().replace(microsecond=0)
+  warehouse.add_userops([now, now], chain='base')
+  for period in rollup.periods:
+    rollup.refresh(period)
+
+  client = main.app.test_client()
+  headers = {'X-API-Password': main.API_PASSWORD}
+  mismatches = 0
+  for period in rollup.periods:
+    for chain in standin.CHAINS:
+      response = client.get(f"/account_deployer?chain={chain}&timeframe="
+                            f"{period}&sections=accounts_chart",
+                            headers=headers)
+      live = {(row['DATE'], row['FACTORY_NAME'], int(row['NUM_ACCOUNTS']))
+              for row in response.get_json()['accounts_chart']}
+      built = {(row['DATE'], row['FACTORY_NAME'], row['NUM_ACCOUNTS'])
+               for row in rollup.read(period, chain)}
+      if live != built:
+        mismatches += 1
+        click.echo(f"{chain} {period}: live has {sorted(live - built)}, "
+                   f"rollup has {sorted(built - live)}", err=True)
+  click.echo('rollup matches the live query' if not mismatches else
+             f"{mismatches} charts differ")
+  sys.exit(1 if mismatches else 0)
+
+
+def change(old, new):
+  if not old:
+    return f"{new}"
+  return f"{new:.1f} ({(new - old) / old:+.0%})"
+
+
+if __name__ == '__main__':
+  sys.exit(cli())
@@ -0,0 +1,38 @@
+import os
+
+import click
+
+from bench import standin
+
+
+def create_app():
+  """Returns the app wired to the stand-in, configured from BENCH_* vars.
+
+  For several workers sharing a cache, point BENCH_REDIS at a real Redis:
+  BENCH_REDIS=redis://localhost:6379/0 gunicorn 'bench.serve:create_app()'
+  """
+  standin.install(latency=float(os.environ.get('BENCH_LATENCY', 0)),
+                  redis_url=os.environ.get('BENCH_REDIS'),
+                  weeks=int(os.environ.get('BENCH_WEEKS', 104)),
+                  names=int(os.environ.get('BENCH_NAMES', 20)),
+                  userops=int(os.environ.get('BENCH_USEROPS', 200000)))
+  import main
+  return main.app
+
+
+@click.command()
+@click.option('--port', default=8081, show_default=True)
+@click.option('--latency', default=0.0, show_default=True,
+              help='Seconds added to every query as warehouse round trip.')
+@click.option('--redis', 'redis_url', default=None,
+              help='Use this Redis instead of an in-process fake.')
+def serve(port, latency, redis_url):
+  """Serve the app on the offline stand-in, e.g. as a replay target."""
+  os.environ['BENCH_LATENCY'] = str(latency)
+  if redis_url:
+    os.environ['BENCH_REDIS'] = redis_url
+  create_app().run(host='127.0.0.1', port=port, threaded=True)
+
+
+if __name__ == '__main__':
+  serve()
@@ -0,0 +1,368 @@
+import collections
+import datetime
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+
+import duckdb
+
+CHAINS = ('all', 'ethereum', 'base', 'arbitrum', 'optimism', 'polygon')
+
+# Synthetic DBT_KOFI tables: kind, the name columns each row is split by and
+# the measures with their types. 'series' tables have DATE, CHAIN and
+# TIMEFRAME rows for weeks and months, 'leaderboard' and 'summary' tables
+# are per CHAIN and 'daily' tables have a DAY per CHAIN.
+METRIC_TABLES = {
+  'ERC4337_OVERVIEW_SUMMARY_STATS_METRIC': (
+    'summary', [], {'NUM_ACCOUNTS': 'count', 'NUM_USEROPS': 'count',
+                    'NUM_TXNS': 'count', 'GAS_SPENT': 'amount'}),
+  'ERC4337_OVERVIEW_ACCOUNTS_BY_CATEGORY_METRIC': (
+    'series', ['CATEGORY'], {'NUM_ACCOUNTS': 'count'}),
+  'ERC4337_OVERVIEW_ACTIVE_ACCOUNTS_METRIC': (
+    'series', [], {'NUM_ACCOUNTS': 'count'}),
+  'ERC4337_OVERVIEW_USEROPS_METRIC': ('series', [], {'NUM_USEROPS': 'count'}),
+  'ERC4337_OVERVIEW_PAYMASTER_SPEND_METRIC': (
+    'series', [], {'GAS_SPENT': 'amount'}),
+  'ERC4337_OVERVIEW_BUNDLER_REVENUE_METRIC': (
+    'series', [], {'REVENUE': 'amount'}),
+  'ERC4337_BUNDLER_LEADERBOARD_METRIC': (
+    'leaderboard', ['BUNDLER_NAME'],
+    {'NUM_USEROPS': 'count', 'NUM_TXNS': 'count', 'REVENUE': 'amount'}),
+  'ERC4337_BUNDLER_USEROPS_METRIC': (
+    'series', ['BUNDLER_NAME'], {'NUM_USEROPS': 'count'}),
+  'ERC4337_BUNDLER_REVENUE_METRIC': (
+    'series', ['BUNDLER_NAME'], {'REVENUE': 'amount'}),
+  'ERC4337_BUNDLER_MULTIOP_METRIC': (
+    'series', [], {'PCT_MULTI_USEROP': 'ratio'}),
+  'ERC4337_BUNDLER_ACCOUNTS_METRIC': (
+    'series', ['BUNDLER_NAME'], {'NUM_ACCOUNTS': 'count'}),
+  'ERC4337_BUNDLER_FRONTRUN_METRIC': (
+    'series', ['BUNDLER_NAME'], {'NUM_BUNDLES': 'count'}),
+  'ERC4337_BUNDLER_FRONTRUN_PCT_METRIC': (
+    'series', [], {'PCT_FRONTRUN': 'ratio'}),
+  'ERC4337_PAYMASTER_LEADERBOARD_METRIC': (
+    'leaderboard', ['PAYMASTER_NAME'],
+    {'NUM_USEROPS': 'count', 'GAS_SPENT': 'amount'}),
+  'ERC4337_PAYMASTER_USEROPS_METRIC': (
+    'series', ['PAYMASTER_NAME'], {'NUM_USEROPS': 'count'}),
+  'ERC4337_PAYMASTER_SPEND_METRIC': (
+    'series', ['PAYMASTER_NAME'], {'GAS_SPENT': 'amount'}),
+  'ERC4337_PAYMASTER_ACCOUNTS_METRIC': (
+    'series', ['PAYMASTER_NAME'], {'NUM_ACCOUNTS': 'count'}),
+  'ERC4337_PAYMASTER_SPEND_TYPE_METRIC': (
+    'series', ['PAYMASTER_TYPE'], {'GAS_SPENT': 'amount'}),
+  'ERC4337_APPS_USAGE_METRIC': (
+    'series', ['PROJECT'], {'NUM_UNIQUE_SENDERS': 'count'}),
+  'ERC4337_APPS_OPS_METRIC': ('series', ['PROJECT'], {'NUM_OPS': 'count'}),
+  'ERC4337_APPS_LEADERBOARD_METRIC': (
+    'leaderboard', ['PROJECT'],
+    {'NUM_UNIQUE_SENDERS': 'count', 'NUM_OPS': 'count'}),
+  'ERC4337_ACTIVATION_NEW_ACCOUNTS_METRIC': (
+    'series', ['PROVIDER'], {'NUM_ACCOUNTS': 'count'}),
+  'ERC4337_ACTIVATION_NEW_ACCOUNTS_CHAIN_METRIC': (
+    'series', [], {'NUM_ACCOUNTS': 'count'}),
+  'EIP7702_METRICS_TOTAL_SUMMARY': (
+    'summary', [], {'LIVE_SMART_WALLETS': 'count', 'NUM_AUTHORIZATIONS': 'count',
+                    'NUM_SET_CODE_TXNS': 'count'}),
+  'EIP7702_OVERVIEW_ACTIONS_TYPE_METRIC': (
+    'series', ['TYPE'], {'NUM_ACTIONS': 'count'}),
+  'EIP7702_OVERVIEW_ACTIVITY_METRIC': (
+    'series', [], {'NUM_AUTHORIZATIONS': 'count', 'NUM_SET_CODE_TXNS': 'count'}),
+  'EIP7702_OVERVIEW_ACTIVE_WALLETS_METRIC': (
+    'series', [], {'ACTIVE_ACCOUNTS': 'count'}),
+  'EIP7702_OVERVIEW_ACTIONS_METRIC': ('series', [], {'NUM_ACTIONS': 'count'}),
+  'EIP7702_METRICS_DAILY_AUTHORITY_STATE': (
+    'daily', [], {'LIVE_SMART_WALLETS': 'count',
+                  'LIVE_AUTHORIZED_CONTRACTS': 'count'}),
+  'EIP7702_AUTH_CONTRACT_LEADERBOARD_METRIC': (
+    'leaderboard', ['AUTHORIZED_CONTRACT'], {'NUM_WALLETS': 'count'}),
+  'EIP7702_AUTH_CONTRACT_LIVE_WALLETS_METRIC': (
+    'series', ['AUTHORIZED_CONTRACT'], {'NUM_WALLETS': 'count'}),
+  'EIP7702_APPS_USAGE_METRIC': (
+    'series', ['PROJECT'], {'NUM_UNIQUE_SENDERS': 'count'}),
+  'EIP7702_APPS_NONCRIME_USAGE_METRIC': (
+    'series', ['PROJECT'], {'NUM_UNIQUE_SENDERS': 'count'}),
+  'EIP7702_4337_OVERLAP_USEROPS_METRIC': (
+    'series', ['AUTHORIZED_CONTRACT'], {'NUM_USEROPS': 'count'}),
+  'EIP7702_4337_OVERLAP_ACCOUNTS_METRIC': (
+    'series', ['AUTHORIZED_CONTRACT'], {'NUM_ACCOUNTS': 'count'}),
+}
+
+MEASURE_SQL = {
+  'count': "CAST(hash(DATE, CHAIN, n, '{column}', {seed}) % 100000 AS BIGINT)",
+  'amount': "CAST((hash(DATE, CHAIN, n, '{column}', {seed}) % 100000000) "
+            "/ 1000.0 AS DECIMAL(38, 6))",
+  'ratio': "(hash(DATE, CHAIN, n, '{column}', {seed}) % 1000) / 1000.0",
+}
+
+# Snowflake syntax DuckDB lacks, mapped onto what it has. TO_VARCHAR is
+# only ever used with 'YYYY-MM-DD'.
+MACROS = (
+  "CREATE OR REPLACE MACRO to_varchar(x, fmt) AS "
+  "strftime(CAST(x AS TIMESTAMP), '%Y-%m-%d')",
+  "CREATE OR REPLACE MACRO iff(c, a, b) AS CASE WHEN c THEN a ELSE b END",
+  "CREATE OR REPLACE MACRO startswith(s, p) AS starts_with(s, p)",
+)
+REWRITES = (
+  (re.compile(r'BUNDLEBEAR\.INFORMATION_SCHEMA\.TABLES', re.I),
+   'BUNDLEBEAR.BENCH_META.TABLES'),
+  (re.compile(r"TO_TIMESTAMP\('([^']*)'\)", re.I), r"CAST('\1' AS TIMESTAMP)"),
+  (re.compile(r'CURRENT_DATE\(\)', re.I), 'CURRENT_DATE'),
+)
+
+Column = collections.namedtuple('Column', 'name type_code')
+
+
+def translate(sql):
+  for pattern, replacement in REWRITES:
+    sql = pattern.sub(replacement, sql)
+  return sql
+
+
+class Cursor:
+  """The parts of a Snowflake cursor the app uses, answered by DuckDB."""
+
+  def __init__(self, conn):
+    self._conn = conn
+    self._table = None
+    self.description = None
+    self.rowcount = None
+    self.sfqid = None
+
+  def execute(self, sql):
+    if self._conn.latency:
+      time.sleep(self._conn.latency)
+    result = self._conn.duck.execute(translate(sql))
+    to_arrow = (getattr(result, 'to_arrow_table', None) or
+                result.fetch_arrow_table)
+    self._table = to_arrow()
+    self.description = [Column(name, None) for name in self._table.column_names]
+    self.rowcount = self._table.num_rows
+    self.sfqid = str(uuid.uuid4())
+    return self
+
+  def fetchall(self):
+    return self._table.to_pylist()
+
+  def fetch_arrow_batches(self):
+    if self._table.num_rows:
+      yield self._table
+
+  def get_result_batches(self):
+    return None
+
+
+class Connection:
+
+  def __init__(self, duck, latency=0.0):
+    self.duck = duck
+    self.latency = latency
+    self._closed = False
+
+  def cursor(self, cursor_class=None):
+    return Cursor(self)
+
+  def is_closed(self):
+    return self._closed
+
+  def close(self):
+    self._closed = True
+    self.duck.close()
+
+
+class Warehouse:
+  """In-memory DuckDB database laid out like BUNDLEBEAR.DBT_KOFI.
+
+  ``connect`` has the signature of ``snowflake.connector.connect`` and
+  returns connections on their own DuckDB cursor, so pooled connections can
+  be used from several threads. ``latency`` seconds are slept before every
+  query to stand in for the warehouse round trip.
+  """
+
+  def __init__(self, latency=0.0):
+    self.latency = latency
+    self.db = duckdb.connect()
+    self._lock = threading.Lock()
+    self.db.execute("ATTACH ':memory:' AS BUNDLEBEAR")
+    self.db.execute('CREATE SCHEMA BUNDLEBEAR.DBT_KOFI')
+    self.db.execute('CREATE SCHEMA BUNDLEBEAR.BENCH_META')
+    for macro in MACROS:
+      self.db.execute(macro)
+
+  def connect(self, **kwargs):
+    with self._lock:
+      return Connection(self.db.cursor(), self.latency)
+
+  def seed(self, weeks=104, names=20, days=365, accounts=20000,
+           userops=200000, factories=10, chains=CHAINS, seed=0,
+           today=None):
+    """Creates every table the routes read, sized by the arguments."""
+    today = today or datetime.date.today()
+    chain_list = ', '.join(f"'{chain}'" for chain in chains)
+    for table, (kind, name_columns, measures) in METRIC_TABLES.items():
+      self._seed_metric(table, kind, name_columns, measures, weeks=weeks,
+                        names=names if name_columns else 1, days=days,
+                        chain_list=chain_list, seed=seed, today=today)
+    self._seed_raw([chain for chain in chains if chain != 'all'],
+                   accounts=accounts, userops=userops, factories=factories,
+                   seed=seed, today=today)
+    self.touch()
+
+  def _seed_metric(self, table, kind, name_columns, measures, weeks, names,
+                   days, chain_list, seed, today):
+    columns = [f"'{column.split('_')[0].lower()}-' || n AS {column}"
+               for column in name_columns]
+    columns += [
+      MEASURE_SQL[kind_].format(column=column, seed=seed) + f" AS {column}"
+      for column, kind_ in measures.items()
+    ]
+    if kind == 'series':
+      periods = f'''
+      SELECT CAST(DATE_TRUNC('week', DATE '{today}') - INTERVAL (i * 7) DAY
+                  AS DATE) AS DATE, 'week' AS TIMEFRAME
+      FROM range({weeks}) r(i)
+      UNION ALL
+      SELECT CAST(DATE_TRUNC('month', DATE '{today}') - INTERVAL (i) MONTH
+                  AS DATE), 'month'
+      FROM range({max(1, weeks * 7 // 30)}) r(i)
+      '''
+      select = 'DATE, CHAIN, TIMEFRAME'
+    elif kind == 'daily':
+      periods = f'''
+      SELECT CAST(DATE '{today}' - INTERVAL (i) DAY AS DATE) AS DATE
+      FROM range({days}) r(i)
+      '''
+      select = 'DATE AS DAY, CHAIN'
+      chain_list += ", 'cross-chain'"
+    else:
+      periods = f"SELECT DATE '{today}' AS DATE"
+      select = 'CHAIN'
+    self.db.execute(f'''
+    CREATE OR REPLACE TABLE BUNDLEBEAR.DBT_KOFI.{table} AS
+    SELECT {select}, {', '.join(columns)}
+    FROM ({periods}) periods,
+         (SELECT unnest([{chain_list}]) AS CHAIN) chains,
+         (SELECT i AS n FROM range({names}) r(i)) names
+    ''')
+
+  def _seed_raw(self, chains, accounts, userops, factories, seed, today):
+    chain_list = ', '.join(f"'{chain}'" for chain in chains)
+    start = datetime.datetime.combine(today, datetime.time()) - \
+      datetime.timedelta(days=730)
+    span = 730 * 86400
+    # User ops come after their deployment but never after the seeded day
+    # (or the current time, if that is today).
+    now = min(datetime.datetime.now(), datetime.datetime.combine(
+      today + datetime.timedelta(days=1), datetime.time()))
+    self.db.execute(f'''
+    CREATE OR REPLACE TABLE BUNDLEBEAR.DBT_KOFI.ERC4337_LABELS_FACTORIES AS
+    SELECT '0xf' || i AS ADDRESS, 'factory-' || i AS NAME
+    FROM range({factories}) r(i)
+    ''')
+    # A couple of factories stay unlabelled to exercise COALESCE(.., 'Unknown').
+    self.db.execute(f'''
+    CREATE OR REPLACE TABLE BUNDLEBEAR.DBT_KOFI.ERC4337_ALL_ACCOUNT_DEPLOYMENTS AS
+    SELECT
+      i AS ACCOUNT_ID,
+      '0xa' || i AS ACCOUNT_ADDRESS,
+      [{chain_list}][1 + i % {len(chains)}] AS CHAIN,
+      '0xf' || (hash(i, 'factory', {seed}) % {factories + 2}) AS FACTORY,
+      'factory-' || (hash(i, 'factory', {seed}) % {factories + 2}) AS FACTORY_NAME,
+      TIMESTAMP '{start}' + INTERVAL (hash(i, 'deployed', {seed}) % {span}) SECOND
+        AS BLOCK_TIME
+    FROM range({accounts}) r(i)
+    ''')
+    self.db.execute(f'''
+    CREATE OR REPLACE TABLE BUNDLEBEAR.DBT_KOFI.ERC4337_ALL_USEROPS AS
+    SELECT
+      LEAST(ad.BLOCK_TIME + INTERVAL (hash(i, 'op', {seed}) % 86400 * 30) SECOND,
+            TIMESTAMP '{now}') AS BLOCK_TIME,
+      ad.ACCOUNT_ADDRESS AS SENDER,
+      ad.CHAIN
+    FROM range({userops}) r(i)
+    JOIN BUNDLEBEAR.DBT_KOFI.ERC4337_ALL_ACCOUNT_DEPLOYMENTS ad
+      ON ad.ACCOUNT_ID = hash(i, 'sender', {seed}) % {accounts}
+    ''')
+    for chain in chains:
+      for table in ('USEROPS', 'ACCOUNT_DEPLOYMENTS'):
+        self.db.execute(f'''
+        CREATE OR REPLACE VIEW BUNDLEBEAR.DBT_KOFI.ERC4337_{chain}_{table} AS
+        SELECT * FROM BUNDLEBEAR.DBT_KOFI.ERC4337_ALL_{table}
+        WHERE CHAIN = '{chain}'
+        ''')
+
+  def add_userops(self, block_times, chain='ethereum'):
+    """Appends one user op at each of ``block_times``, each from an account
+    deployed just for it, so it adds one account to its bucket."""
+    for block_time in block_times:
+      address = f"0xb{uuid.uuid4().hex}"
+      self.db.execute(f'''
+      INSERT INTO BUNDLEBEAR.DBT_KOFI.ERC4337_ALL_ACCOUNT_DEPLOYMENTS
+      SELECT MAX(ACCOUNT_ID) + 1, '{address}', '{chain}', '0xf0', 'factory-0',
+             TIMESTAMP '{block_time}'
+      FROM BUNDLEBEAR.DBT_KOFI.ERC4337_ALL_ACCOUNT_DEPLOYMENTS
+      ''')
+      self.db.execute(f'''
+      INSERT INTO BUNDLEBEAR.DBT_KOFI.ERC4337_ALL_USEROPS
+      VALUES (TIMESTAMP '{block_time}', '{address}', '{chain}')
+      ''')
+    self.touch(['ERC4337_ALL_ACCOUNT_DEPLOYMENTS', 'ERC4337_ALL_USEROPS'])
+
+  def latest_userop(self):
+    """The lowest of the chains' latest user op times, as a datetime."""
+    return self.db.execute('''
+    SELECT MIN(BLOCK_TIME) FROM (
+      SELECT MAX(BLOCK_TIME) AS BLOCK_TIME
+      FROM BUNDLEBEAR.DBT_KOFI.ERC4337_ALL_USEROPS GROUP BY CHAIN)
+    ''').fetchone()[0]
+
+  def touch(self, tables=None):
+    """Bumps LAST_ALTERED, as a dbt run would, for ``tables`` or all."""
+    if tables is None:
+      self.db.execute('''
+      CREATE OR REPLACE TABLE BUNDLEBEAR.BENCH_META.TABLES AS
+      SELECT schema_name AS TABLE_SCHEMA, table_name AS TABLE_NAME,
+             now() AS LAST_ALTERED
+      FROM duckdb_tables()
+      WHERE database_name = 'BUNDLEBEAR' AND schema_name = 'DBT_KOFI'
+      ''')
+      return
+    names = ', '.join(f"'{table}'" for table in tables)
+    self.db.execute(f'''
+    UPDATE BUNDLEBEAR.BENCH_META.TABLES SET LAST_ALTERED = now()
+    WHERE TABLE_NAME IN ({names})
+    ''')
+
+
+def install(latency=0.0, rollup_path=None, redis_url=None, **seed_kwargs):
+  """Points the app at a seeded Warehouse and an in-process Redis.
+
+  With ``redis_url`` a real Redis is used instead, which lets several
+  processes share one cache. Must run before ``main`` is imported. Returns
+  the Warehouse.
+  """
+  import redis
+  import snowflake.connector
+
+  for name in ('SNOWFLAKE_USER', 'SNOWFLAKE_PASS', 'SNOWFLAKE_ACCOUNT',
+               'SNOWFLAKE_WAREHOUSE', 'API_PASSWORD'):
+    os.environ.setdefault(name, 'bench')
+  os.environ['REDIS'] = redis_url or 'redis://localhost:6379/0'
+  # Keep the benchmark off any accounts rollup built on this machine.
+  os.environ['ACCOUNTS_ROLLUP_PATH'] = rollup_path or os.path.join(
+    tempfile.mkdtemp(prefix='bench-'), 'accounts_rollup.sqlite3')
+
+  if redis_url is None:
+    import fakeredis
+    server = fakeredis.FakeServer()
+    redis.Redis.from_url = classmethod(
+      lambda cls, url, **kwargs: fakeredis.FakeRedis(server=server, **kwargs))
+    redis.StrictRedis.from_url = redis.Redis.from_url
+
+  warehouse = Warehouse(latency=latency)
+  warehouse.seed(**seed_kwargs)
+  snowflake.connector.connect = warehouse.connect
+  return warehouse
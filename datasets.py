@@ -0,0 +1,201 @@
+import base64
+import bisect
+import datetime
+import itertools
+import json
+from decimal import Decimal, InvalidOperation
+
+import numpy as np
+
+NUMERIC_TYPES = (int, float, Decimal)
+
+
+def dictionary_encode(values):
+  """Returns ``{dictionary, codes}`` for a repetitive non-numeric column.
+
+  Columns holding numbers, or where fewer than half the values repeat, are
+  left alone (None is returned) since encoding them would not pay off.
+  """
+  if any(isinstance(value, NUMERIC_TYPES) for value in values):
+    return None
+  dictionary = {}
+  codes = [dictionary.setdefault(value, len(dictionary)) for value in values]
+  if len(dictionary) * 2 > len(values):
+    return None
+  return {'dictionary': list(dictionary), 'codes': codes}
+
+
+def to_columnar(rows):
+  """Turns a list of row dicts into ``{columns, data: {column: values}}``."""
+  columns = list(rows[0]) if rows else []
+  data = {}
+  for column in columns:
+    values = [row[column] for row in rows]
+    data[column] = dictionary_encode(values) or values
+  return {'columns': columns, 'data': data}
+
+
+def encode_cursor(value, label):
+  """Opaque ``?after=`` token for the row ranked by ``(value, label)``."""
+  # Decimals travel as strings so the next page compares them exactly.
+  data = json.dumps([value, label], default=str, separators=(',', ':'))
+  return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+  """Inverse of ``encode_cursor``; raises ValueError for a malformed token."""
+  try:
+    value, label = json.loads(
+      base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    if isinstance(value, str):
+      value = Decimal(value)
+  except (TypeError, ValueError, InvalidOperation) as e:
+    raise ValueError(f"Invalid cursor: {cursor}") from e
+  if not (value is None or isinstance(value, NUMERIC_TYPES)
+          and is_moderate(Decimal(value))) or not (
+      label is None or isinstance(label, str)):
+    raise ValueError(f"Invalid cursor: {cursor}")
+  return value, label
+
+
+def is_moderate(number):
+  # Finite, no more digits than a NUMBER(38) and within about float range,
+  # so that int() and str() of it stay cheap.
+  return (number.is_finite() and len(number.as_tuple().digits) <= 38
+          and abs(number.adjusted()) <= 400)
+
+
+def date_key(value):
+  # Dates, datetimes and 'YYYY-MM-DD...' strings all compare as ISO text.
+  return '' if value is None else str(value)[:10]
+
+
+def slice_dates(rows, start=None, end=None, column='DATE'):
+  """Returns the rows dated from ``start`` to ``end`` inclusive (ISO dates).
+
+  ``rows`` must be sorted by ``column``; the bounds are found by binary
+  search. Rows without the column are returned unchanged.
+  """
+  if not rows or (start is None and end is None) or column not in rows[0]:
+    return rows
+  key = lambda row: date_key(row[column])
+  lo = 0 if start is None else bisect.bisect_left(rows, start, key=key)
+  hi = len(rows) if end is None else bisect.bisect_right(rows, end, key=key)
+  return rows[lo:hi]
+
+
+def split_columns(rows, column='DATE'):
+  """Returns the label and the numeric columns of ``rows`` besides ``column``."""
+  labels, values = [], []
+  for name in rows[0]:
+    if name != column:
+      sample = next((row[name] for row in rows if row[name] is not None), None)
+      (values if isinstance(sample, NUMERIC_TYPES) else labels).append(name)
+  return labels, values
+
+
+def lttb(x, y, threshold):
+  """Indices of ``threshold`` points picked by Largest-Triangle-Three-Buckets.
+
+  The first and last points are kept; each bucket in between contributes
+  the point forming the largest triangle with the previous pick and the
+  next bucket's average, which keeps peaks and dips visible.
+  """
+  n = len(x)
+  if threshold >= n or threshold < 3:
+    return np.arange(n)
+  edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+  picked = np.empty(threshold, dtype=int)
+  picked[0], picked[-1] = 0, n - 1
+  a = 0
+  for i in range(threshold - 2):
+    lo, hi = edges[i], edges[i + 1]
+    if i + 2 < len(edges):
+      next_x = x[hi:edges[i + 2]].mean()
+      next_y = y[hi:edges[i + 2]].mean()
+    else:
+      next_x, next_y = x[-1], y[-1]
+    area = np.abs((x[a] - next_x) * (y[lo:hi] - y[a]) -
+                  (x[a] - x[lo:hi]) * (next_y - y[a]))
+    a = lo + int(area.argmax())
+    picked[i + 1] = a
+  return picked
+
+
+def downsample(rows, max_points, column='DATE'):
+  """Thins every series in ``rows`` to at most ``max_points`` rows with LTTB.
+
+  A series is the rows sharing the values of the non-numeric columns, such
+  as CHAIN or BUNDLER_NAME; its points are placed by ``column`` and the
+  first numeric column. ``rows`` must be sorted by ``column``.
+  """
+  if not rows or max_points is None or column not in rows[0]:
+    return rows
+  labels, values = split_columns(rows, column)
+  if not values:
+    return rows
+  value = values[0]
+
+  series = {}
+  keep = []
+  for i, row in enumerate(rows):
+    if row[column] is None:
+      keep.append(i)
+    else:
+      series.setdefault(tuple(row[name] for name in labels), []).append(i)
+  for indices in series.values():
+    if len(indices) <= max_points:
+      keep.extend(indices)
+      continue
+    x = np.array([datetime.date.fromisoformat(date_key(rows[i][column]))
+                  .toordinal() for i in indices], dtype=float)
+    y = np.array([rows[i][value] or 0 for i in indices], dtype=float)
+    keep.extend(indices[j] for j in lttb(x, y, max_points))
+  keep.sort()
+  return [rows[i] for i in keep]
+
+
+def top_n(rows, n, by='total', column='DATE', other='other'):
+  """Keeps the ``n`` largest series of a breakdown chart, summing the rest.
+
+  Applies to rows of one label column and numeric value columns, such as
+  (DATE, BUNDLER_NAME, NUM_USEROPS); others are returned unchanged. Series
+  are ranked by the first value column, either summed over all dates
+  (``by='total'``, the same series on every date) or on each date
+  (``by='date'``). The rest of each date is summed into one ``other`` row.
+  ``rows`` must be sorted by ``column``.
+  """
+  if not rows or n is None or column not in rows[0]:
+    return rows
+  labels, values = split_columns(rows, column)
+  if len(labels) != 1 or not values:
+    return rows
+  label, value = labels[0], values[0]
+  rank = lambda item: (-item[1], str(item[0]))
+
+  if by == 'total':
+    totals = {}
+    for row in rows:
+      totals[row[label]] = totals.get(row[label], 0) + (row[value] or 0)
+    if len(totals) <= n:
+      return rows
+    top = {name for name, _ in sorted(totals.items(), key=rank)[:n]}
+
+  result = []
+  for date, group in itertools.groupby(rows, key=lambda row: row[column]):
+    group = list(group)
+    if by == 'total':
+      kept = [row for row in group if row[label] in top]
+      rest = [row for row in group if row[label] not in top]
+    else:
+      group.sort(key=lambda row: rank((row[label], row[value] or 0)))
+      kept, rest = group[:n], group[n:]
+    result.extend(kept)
+    if rest:
+      result.append({
+        column: date,
+        label: other,
+        **{name: sum(row[name] for row in rest if row[name] is not None)
+           for name in values},
+      })
+  return result
@@ -1,9 +1,34 @@
-from flask import Flask, jsonify, request, abort
+from flask import Flask, g, jsonify, request, abort
 from flask_cors import CORS
 from flask_caching import Cache
 import snowflake.connector
 from snowflake.connector import DictCursor
+from snowflake_pool import ConnectionPool, is_session_expired
+from snowflake_async import AsyncQueryRunner
+import snowflake_arrow
+from response_cache import ResponseCache, index_key, make_entry, make_meta
+from table_cache import Table, TableCache
+from accounts_rollup import AccountsRollup, months_before, period_start
+from datasets import (decode_cursor, downsample, encode_cursor, slice_dates,
+                      to_columnar, top_n)
+import metrics
+import timing
+from traffic import TrafficCapture
+from concurrent.futures import (FIRST_EXCEPTION, Future, ThreadPoolExecutor,
+                                as_completed, wait)
+import click
+import contextvars
+import datetime
+import fnmatch
+import hashlib
+import json
+import math
+import redis
 import os
+import threading
+import time
+from functools import partial, wraps
+from urllib.parse import urlencode
 
 REDIS_LINK = os.environ['REDIS']
 SNOWFLAKE_USER = os.environ['SNOWFLAKE_USER']
@@ -12,6 +37,51 @@ SNOWFLAKE_ACCOUNT = os.environ['SNOWFLAKE_ACCOUNT']
 SNOWFLAKE_WAREHOUSE = os.environ['SNOWFLAKE_WAREHOUSE']
 API_PASSWORD = os.environ['API_PASSWORD']
 
+SNOWFLAKE_POOL_SIZE = int(os.environ.get('SNOWFLAKE_POOL_SIZE', 4))
+SNOWFLAKE_POOL_TIMEOUT = int(os.environ.get('SNOWFLAKE_POOL_TIMEOUT', 30))
+SNOWFLAKE_HEALTHCHECK_INTERVAL = int(
+  os.environ.get('SNOWFLAKE_HEALTHCHECK_INTERVAL', 300))
+SNOWFLAKE_QUERY_CONCURRENCY = int(
+  os.environ.get('SNOWFLAKE_QUERY_CONCURRENCY', SNOWFLAKE_POOL_SIZE))
+QUERY_TIMEOUT = int(os.environ.get('QUERY_TIMEOUT', 120))
+WARM_CONCURRENCY = int(os.environ.get('WARM_CONCURRENCY', 2))
+# Largest ?limit= accepted for a leaderboard page.
+MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE', 1000))
+CACHE_STALE_TIMEOUT = int(os.environ.get('CACHE_STALE_TIMEOUT', 86400))
+# Lifetime of responses for one page or slice of a route, which are never
+# rewarmed (see VARIANT_PARAMS).
+CACHE_VARIANT_TIMEOUT = int(os.environ.get('CACHE_VARIANT_TIMEOUT', 3600))
+CACHE_FILL_LEASE = int(os.environ.get('CACHE_FILL_LEASE', QUERY_TIMEOUT + 30))
+LOCAL_CACHE_MAX_BYTES = int(
+  os.environ.get('LOCAL_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+LOCAL_CACHE_TTL = int(os.environ.get('LOCAL_CACHE_TTL', 300))
+TABLE_CACHE_TTL = int(os.environ.get('TABLE_CACHE_TTL', 3600))
+TABLE_FULL_REFRESH_INTERVAL = int(
+  os.environ.get('TABLE_FULL_REFRESH_INTERVAL', 86400))
+HTTP_MAX_AGE = int(os.environ.get('HTTP_MAX_AGE', 3600))
+# 'ttl' expires entries after CACHE_DEFAULT_TIMEOUT; 'tables' keeps them until
+# `flask refresh-changed` sees one of their source tables change.
+CACHE_INVALIDATION = os.environ.get('CACHE_INVALIDATION', 'ttl')
+SNOWFLAKE_ASYNC_QUERIES = os.environ.get('SNOWFLAKE_ASYNC_QUERIES',
+                                         'false').lower() == 'true'
+SNOWFLAKE_POLL_INTERVAL = float(os.environ.get('SNOWFLAKE_POLL_INTERVAL', 0.2))
+# Send a Server-Timing header with each response, and optionally log the
+# same breakdown as one JSON line per request.
+SERVER_TIMING = os.environ.get('SERVER_TIMING', 'true').lower() == 'true'
+REQUEST_TIMING_LOG = os.environ.get('REQUEST_TIMING_LOG',
+                                    'false').lower() == 'true'
+# Append a sample of requests to this JSONL file for bench/replay.py.
+TRAFFIC_CAPTURE_PATH = os.environ.get('TRAFFIC_CAPTURE_PATH')
+TRAFFIC_CAPTURE_SAMPLE_RATE = float(
+  os.environ.get('TRAFFIC_CAPTURE_SAMPLE_RATE', 0.1))
+ACCOUNTS_ROLLUP_PATH = os.environ.get('ACCOUNTS_ROLLUP_PATH',
+                                      'accounts_rollup.sqlite3')
+ACCOUNTS_ROLLUP_PERIODS = os.environ.get('ACCOUNTS_ROLLUP_PERIODS',
+                                         'week,month').split(',')
+# Read results as Arrow batches instead of DictCursor rows.
+SNOWFLAKE_ARROW_FETCH = os.environ.get('SNOWFLAKE_ARROW_FETCH',
+                                       'false').lower() == 'true'
+
 config = {
   "CACHE_TYPE": "redis",
   "CACHE_DEFAULT_TIMEOUT": 57600,
@@ -24,859 +94,1491 @@ cache = Cache(app)
 CORS(app)
 
 
+# Bump to orphan every cached entry when the shape of a response changes.
+# Arrow fetches serve decimals as JSON numbers rather than strings, so what
+# is cached under either mode is kept under keys of its own.
+FETCH_KEY_SUFFIX = '-arrow' if SNOWFLAKE_ARROW_FETCH else ''
+CACHE_KEY_VERSION = os.environ.get('CACHE_KEY_VERSION', '5') + FETCH_KEY_SUFFIX
+
+# Query params each route reads, with the defaults the handlers fall back to.
+# Only these go into cache keys, so requests that differ only in omitted
+# defaults, param order or unknown params share one entry.
+ROUTE_PARAMS = {
+  '/overview': {'chain': 'all', 'timeframe': 'week'},
+  '/bundler': {'chain': 'all', 'timeframe': 'week'},
+  '/paymaster': {'chain': 'all', 'timeframe': 'week'},
+  '/account_deployer': {'chain': 'all', 'timeframe': 'week'},
+  '/apps': {'chain': 'all', 'timeframe': 'week'},
+  '/eip7702-overview': {'chain': 'all', 'timeframe': 'week'},
+  '/eip7702-authorized-contracts': {'chain': 'all'},
+  '/eip7702-apps': {'chain': 'all', 'timeframe': 'week'},
+  '/erc4337-activation': {'chain': 'all', 'timeframe': 'week'},
+  '/eip7702-x-erc4337': {'chain': 'all', 'timeframe': 'week'},
+}
+
+# Params every route accepts that only change how the data is laid out in
+# the response, not which data is fetched. sections is empty for all.
+SHAPE_PARAMS = {'format': 'rows', 'sections': '', 'max_points': '', 'top': '',
+                'top_by': 'total'}
+RESPONSE_FORMATS = ('rows', 'columnar')
+TOP_BY = ('total', 'date')
+# Params selecting one page of a leaderboard; only leaderboards read them.
+PAGE_PARAMS = {'limit': '', 'after': ''}
+# Inclusive date range applied to every section with a DATE column.
+RANGE_PARAMS = {'from': '', 'to': ''}
+# Params taking arbitrary client values. Responses using them are cached for
+# CACHE_VARIANT_TIMEOUT only and dropped, not rewarmed, when data changes.
+VARIANT_PARAMS = dict(PAGE_PARAMS, **RANGE_PARAMS, **{
+  name: SHAPE_PARAMS[name] for name in ('max_points', 'top', 'top_by')})
+
+
+def requested_sections(args):
+  return sorted(set(name for name in args.get('sections', '').split(',')
+                    if name))
+
+
+def canonical_params(path, args):
+  if path not in ROUTE_PARAMS:
+    return {}
+  defaults = dict(ROUTE_PARAMS[path], **SHAPE_PARAMS, **PAGE_PARAMS,
+                  **RANGE_PARAMS)
+  params = {name: args.get(name, default) for name, default in defaults.items()}
+  params['sections'] = ','.join(requested_sections(args))
+  return params
+
+
+def build_cache_key(path, params):
+  return f"v{CACHE_KEY_VERSION}:{path}?{urlencode(sorted(params.items()))}"
+
+
 def make_cache_key(*args, **kwargs):
-  path = request.path
-  args = str(hash(frozenset(request.args.items())))
-  return (path + args).encode('utf-8')
+  return build_cache_key(request.path,
+                         canonical_params(request.path, request.args))
 
 
-def execute_sql(sql_string, **kwargs):
-  conn = snowflake.connector.connect(user=SNOWFLAKE_USER,
+def record_cache_lookup(path, tier, hit):
+  metrics.observe_cache_lookup(path, tier, hit)
+  g.cache_result = tier if hit else 'miss'
+
+
+def is_variant_request():
+  return any(request.args.get(name, default) != default
+             for name, default in VARIANT_PARAMS.items())
+
+
+def is_cache_refresh():
+  # Lets the cache warmer recompute an entry that is still cached.
+  return (request.headers.get('X-Cache-Refresh') == '1'
+          and request.headers.get('X-API-Password') == API_PASSWORD)
+
+
+redis_client = redis.Redis.from_url(REDIS_LINK)
+response_cache = ResponseCache(app, cache, redis_client, make_cache_key,
+                               forced_update=is_cache_refresh,
+                               on_lookup=record_cache_lookup,
+                               timeout=(None if CACHE_INVALIDATION == 'tables'
+                                        else config["CACHE_DEFAULT_TIMEOUT"]),
+                               stale_timeout=CACHE_STALE_TIMEOUT,
+                               lease=CACHE_FILL_LEASE,
+                               local_max_bytes=LOCAL_CACHE_MAX_BYTES,
+                               local_ttl=LOCAL_CACHE_TTL,
+                               max_age=HTTP_MAX_AGE,
+                               is_variant=is_variant_request,
+                               variant_timeout=CACHE_VARIANT_TIMEOUT)
+cached_view = response_cache.view
+
+TABLE_VERSIONS_KEY = 'cache:table-versions'
+PENDING_ROUTES_KEY = 'cache:pending-routes'
+
+
+def connect_snowflake():
+  return snowflake.connector.connect(user=SNOWFLAKE_USER,
                                      password=SNOWFLAKE_PASS,
                                      account=SNOWFLAKE_ACCOUNT,
                                      warehouse=SNOWFLAKE_WAREHOUSE,
                                      database="BUNDLEBEAR",
                                      schema="DBT_KOFI",
+                                     client_session_keep_alive=True,
                                      disable_ocsp_checks=True)
 
+
+snowflake_pool = ConnectionPool(connect_snowflake,
+                                size=SNOWFLAKE_POOL_SIZE,
+                                timeout=SNOWFLAKE_POOL_TIMEOUT,
+                                healthcheck_interval=SNOWFLAKE_HEALTHCHECK_INTERVAL)
+
+
+def fetch_rows(cursor):
+  if SNOWFLAKE_ARROW_FETCH:
+    return snowflake_arrow.fetch_rows(cursor)
+  return cursor.fetchall()
+
+
+def run_sql(sql_string, fetch, **kwargs):
   sql = sql_string.format(**kwargs)
-  # res = conn.cursor(DictCursor).execute(sql)
-  # results = res.fetchall()
-  # conn.close()
+  dataset = metrics.dataset_of(sql)
+  for attempt in range(2):
+    start = time.perf_counter()
+    try:
+      with snowflake_pool.connection() as conn:
+        connected = time.perf_counter()
+        cursor = conn.cursor(DictCursor).execute(sql)
+        results = fetch(cursor)
+      finished = time.perf_counter()
+      timing.record('sf-connect', connected - start)
+      timing.record('sf-query', finished - connected)
+      metrics.observe_query(dataset, finished - start,
+                            cursor.rowcount or 0, connect=connected - start,
+                            size=metrics.result_bytes(cursor),
+                            query_id=cursor.sfqid)
+      return results
+    except Exception as e:
+      # The pool drops connections whose session has expired, so one retry
+      # is enough to log in again.
+      if attempt == 0 and is_session_expired(e):
+        continue
+      metrics.observe_error(dataset)
+      print(f"An error occurred while executing the SQL query: {sql}")
+      raise e
+
+
+def execute_sql(sql_string, **kwargs):
+  return run_sql(sql_string, fetch_rows, **kwargs)
+
+
+def sql_literal(value):
+  # Quotes a client-supplied string for Snowflake, where backslash starts an
+  # escape sequence inside '...' as well as a doubled quote.
+  return "'" + str(value).replace('\\', '\\\\').replace("'", "''") + "'"
+
+
+query_executor = ThreadPoolExecutor(max_workers=SNOWFLAKE_QUERY_CONCURRENCY,
+                                    thread_name_prefix='snowflake')
+
+
+async_runner = AsyncQueryRunner(snowflake_pool,
+                                poll_interval=SNOWFLAKE_POLL_INTERVAL,
+                                fetch_workers=SNOWFLAKE_QUERY_CONCURRENCY,
+                                fetch=fetch_rows)
+
+
+def execute_sql_async(sql_string, **kwargs):
+  sql = sql_string.format(**kwargs)
+  dataset = metrics.dataset_of(sql)
+  start = time.perf_counter()
   try:
-    res = conn.cursor(DictCursor).execute(sql)
-    results = res.fetchall()
+    future = async_runner.submit(sql)
   except Exception as e:
+    metrics.observe_error(dataset)
     print(f"An error occurred while executing the SQL query: {sql}")
     raise e
-  finally:
-    conn.close()
-  return results
 
-@app.before_request
-def check_auth():
-    if request.endpoint not in ['account_deployer']:
-        return None
+  context = contextvars.copy_context()
+
+  def report(future):
+    if future.cancelled():
+      return
+    if future.exception() is not None:
+      context.run(metrics.observe_error, dataset)
+      print(f"An error occurred while executing the SQL query: {sql}")
+    else:
+      elapsed = time.perf_counter() - start
+      context.run(timing.record, 'sf-query', elapsed)
+      context.run(metrics.observe_query, dataset, elapsed,
+                  len(future.result()), query_id=future.query_id)
+
+  future.add_done_callback(report)
+  return future
+
+
+# Set by /dashboard to a (lock, futures) pair so the pages it renders share
+# one future per identical query.
+shared_queries = contextvars.ContextVar('shared_queries', default=None)
+
+
+def shared_query(submit):
+  @wraps(submit)
+  def decorated(*args, **kwargs):
+    shared = shared_queries.get()
+    if shared is None:
+      return submit(*args, **kwargs)
+    lock, futures = shared
+    key = repr((submit.__name__, args, sorted(kwargs.items())))
+    with lock:
+      if key not in futures:
+        futures[key] = submit(*args, **kwargs)
+      return futures[key]
+
+  return decorated
+
+
+def submit_query(fn, *args, **kwargs):
+  # Runs fn on the query pool with the caller's context, so queries are
+  # still attributed to the route that needed them.
+  return query_executor.submit(contextvars.copy_context().run, fn, *args,
+                               **kwargs)
+
+
+@shared_query
+def submit_sql(sql_string, **kwargs):
+  if SNOWFLAKE_ASYNC_QUERIES:
+    return execute_sql_async(sql_string, **kwargs)
+  return submit_query(execute_sql, sql_string, **kwargs)
+
+
+def gather(futures, timeout=QUERY_TIMEOUT):
+  # Waits for a dict of named query futures and returns their results under
+  # the same names. The first failure is raised as soon as it happens and
+  # the queries that have not started yet are cancelled.
+  with timing.phase('queries'):
+    done, pending = wait(futures.values(), timeout=timeout,
+                         return_when=FIRST_EXCEPTION)
+  for future in pending:
+    future.cancel()
+  for future in futures.values():
+    if future in done and future.exception() is not None:
+      raise future.exception()
+  if pending:
+    raise TimeoutError(f"Queries did not finish within {timeout}s")
+  return {name: future.result() for name, future in futures.items()}
+
+
+def then(future, fn):
+  # A future for fn(result), for datasets derived from another query's rows.
+  derived = Future()
+
+  def done(future):
+    if not derived.set_running_or_notify_cancel():
+      return
+    try:
+      derived.set_result(fn(future.result()))
+    except BaseException as e:
+      derived.set_exception(e)
+
+  future.add_done_callback(done)
+  return derived
+
+
+def fetch_table(table, since=None, column='DATE'):
+  sql = '''
+  SELECT * FROM BUNDLEBEAR.DBT_KOFI.{table}
+  '''
+  if since is not None:
+    # Only the periods that may still change, to merge into the cached copy.
+    sql += '''
+  WHERE {column} >= '{since}'
+  '''
+  kwargs = dict(table=table, column=column, since=since)
+  if SNOWFLAKE_ARROW_FETCH:
+    # Whole tables are kept column-wise anyway, so skip building rows.
+    return Table(*run_sql(sql, snowflake_arrow.fetch_columns, **kwargs))
+  return Table.from_rows(execute_sql(sql, **kwargs))
+
+
+def table_version(table):
+  version = redis_client.hget(TABLE_VERSIONS_KEY, table)
+  return (version.decode() if version else '') + FETCH_KEY_SUFFIX
+
+
+table_cache = TableCache(cache, fetch_table, table_version,
+                         ttl=TABLE_CACHE_TTL, local_ttl=LOCAL_CACHE_TTL,
+                         full_refresh=TABLE_FULL_REFRESH_INTERVAL)
+
+
+def select_table(table, columns=None, order_by=('DATE',), descending=False,
+                 **where):
+  return table_cache.get(table).select(columns, where, order_by, descending)
+
+
+@shared_query
+def submit_table(table, columns=None, order_by=('DATE',), descending=False,
+                 **where):
+  # Answers `SELECT columns FROM table WHERE col = value ... ORDER BY ...`
+  # from one cached copy of the whole table shared by every chain/timeframe.
+  return submit_query(select_table, table, columns, order_by, descending,
+                      **where)
+
+
+def fetch_account_counts(period, since):
+  # The full window matches the live chart query; an incremental one takes
+  # every op of the bucket holding `since`, including its first instant.
+  if since is None:
+    window = ("u.BLOCK_TIME > "
+              "DATE_TRUNC('{time}', CURRENT_DATE()) - INTERVAL '24 months'")
+  else:
+    window = "u.BLOCK_TIME >= DATE_TRUNC('{time}', TO_TIMESTAMP('{since}'))"
+  return execute_sql('''
+  SELECT
+      DATE,
+      FACTORY_NAME,
+      IFF(GROUPING(CHAIN) = 1, 'all', CHAIN) AS CHAIN,
+      COUNT(DISTINCT SENDER) AS NUM_ACCOUNTS,
+      MAX(BLOCK_TIME) AS LAST_BLOCK_TIME
+  FROM (
+      SELECT
+          TO_VARCHAR(date_trunc('{time}', u.BLOCK_TIME), 'YYYY-MM-DD') as DATE,
+          COALESCE(l.name, 'Unknown') AS FACTORY_NAME,
+          LOWER(u.CHAIN) AS CHAIN,
+          u.SENDER,
+          u.BLOCK_TIME
+      FROM BUNDLEBEAR.DBT_KOFI.ERC4337_ALL_USEROPS u
+      INNER JOIN BUNDLEBEAR.DBT_KOFI.ERC4337_ALL_ACCOUNT_DEPLOYMENTS ad
+          ON ad.ACCOUNT_ADDRESS = u.SENDER
+          AND ad.CHAIN = u.CHAIN
+      LEFT JOIN BUNDLEBEAR.DBT_KOFI.ERC4337_LABELS_FACTORIES l
+          ON l.ADDRESS = ad.FACTORY
+      WHERE ''' + window + '''
+  ) AS combined_data
+  GROUP BY GROUPING SETS ((DATE, FACTORY_NAME, CHAIN), (DATE, FACTORY_NAME))
+  ''',
+                     time=period,
+                     since=since.isoformat() if since else None)
+
+
+accounts_rollup = AccountsRollup(ACCOUNTS_ROLLUP_PATH, fetch_account_counts,
+                                 periods=ACCOUNTS_ROLLUP_PERIODS)
+
+
+@shared_query
+def submit_accounts_chart(sql_string, since=None, until=None, **kwargs):
+  # Served from the local rollup once `flask refresh-rollups` has built it
+  # for this timeframe, from the raw user ops otherwise. The rollup covers
+  # the usual 24 months, so an explicit range always goes to the user ops.
+  timeframe, chain = kwargs['time'], kwargs.get('chain', 'all')
+  if since is None and accounts_rollup.watermark(timeframe) is not None:
+    return submit_query(accounts_rollup.read, timeframe, chain)
+  return submit_sql(sql_string,
+                    window=series_window('u.BLOCK_TIME', timeframe, since,
+                                         until),
+                    **kwargs)
+
+
+def format_param():
+  response_format = request.args.get('format', SHAPE_PARAMS['format'])
+  if response_format not in RESPONSE_FORMATS:
+    abort(400, description=f"format must be one of {', '.join(RESPONSE_FORMATS)}")
+  return response_format
+
+
+def respond(response_data, response_format):
+  # `?format=columnar` sends each dataset as {columns, data: {column: [...]}}
+  # with repeated strings dictionary-encoded; rows stay the default.
+  with timing.phase('json'):
+    if response_format == 'columnar':
+      response_data = {name: to_columnar(rows)
+                       for name, rows in response_data.items()}
+    return jsonify(response_data)
 
-    # Get the password from the request header
-    provided_password = request.headers.get('X-API-Password')
-    
-    # Check if password matches
-    if provided_password != API_PASSWORD:
-        abort(401, description="Unauthorized: Invalid or missing API password")
 
-@app.route('/overview')
-@cache.memoize(make_name=make_cache_key)
-def index():
-  chain = request.args.get('chain', 'all')
-  timeframe = request.args.get('timeframe', 'week')
+def whole_number(value):
+  # Plain ASCII digits only: isdigit() alone lets '²' through, which int()
+  # then rejects, as it does numbers past its digit limit.
+  if not (value.isascii() and value.isdigit()):
+    return None
+  try:
+    return int(value)
+  except ValueError:
+    return None
+
+
+def page_params():
+  limit, after = request.args.get('limit'), request.args.get('after')
+  if limit:
+    limit = whole_number(limit)
+    if limit is None or not 1 <= limit <= MAX_PAGE_SIZE:
+      abort(400, description=f"limit must be between 1 and {MAX_PAGE_SIZE}")
+  if after:
+    try:
+      after = decode_cursor(after)
+    except ValueError as e:
+      abort(400, description=str(e))
+  return limit or None, after or None
+
+
+def paged(section):
+  # Marks a section whose result depends on ?limit= and ?after=.
+  section.paged = True
+  return section
+
+
+def leaderboard_sections(name, value, label, submit_page, submit_total):
+  # Without ?limit= or ?after= the whole leaderboard is one section. With
+  # them it is one page, ranked by value then label, plus `<name>_total`
+  # (cached once for every page) and `<name>_next`, the ?after= cursor of
+  # the following page or null after the last one.
+  limit, after = page_params()
+  if limit is None and after is None:
+    return {name: lambda: submit_page(None, None)}
+
+  def next_page(rows):
+    if limit is None or len(rows) < limit:
+      return [{"AFTER": None}]
+    return [{"AFTER": encode_cursor(rows[-1][value], rows[-1][label])}]
+
+  return {
+    name: paged(lambda: submit_page(limit, after)),
+    f"{name}_total": lambda: then(submit_total(),
+                                  lambda total: [{"TOTAL": total}]),
+    f"{name}_next": paged(lambda: then(submit_page(limit, after), next_page)),
+  }
 
-  summary_stats = execute_sql('''
-  SELECT * FROM BUNDLEBEAR.DBT_KOFI.ERC4337_OVERVIEW_SUMMARY_STATS_METRIC
-  WHERE CHAIN = '{chain}'
-  ''', chain=chain)
 
-  stat_accounts = [{ "NUM_ACCOUNTS": summary_stats[0]["NUM_ACCOUNTS"] }]
+def select_leaderboard(table, columns, value, label, limit, after, **where):
+  return table_cache.get(table).page(columns, where, value, label, limit,
+                                     after)
 
-  stat_userops = [{"NUM_USEROPS": summary_stats[0]["NUM_USEROPS"]}]
 
-  stat_txns = [{"NUM_TXNS": summary_stats[0]["NUM_TXNS"]}]
+@shared_query
+def submit_leaderboard(table, columns, value, label, limit, after, **where):
+  return submit_query(select_leaderboard, table, columns, value, label, limit,
+                      after, **where)
 
-  stat_paymaster_spend = [{"GAS_SPENT": summary_stats[0]["GAS_SPENT"]}]
 
-  accounts_by_category = execute_sql('''
-  SELECT * FROM BUNDLEBEAR.DBT_KOFI.ERC4337_OVERVIEW_ACCOUNTS_BY_CATEGORY_METRIC
-  WHERE TIMEFRAME = '{time}'
-  AND CHAIN = '{chain}'                                      
-  ORDER BY DATE
-  ''',
-                                        chain=chain,
-                                        time=timeframe)                        
+def count_table(table, **where):
+  return table_cache.get(table).count(where)
 
-  if chain == 'all':
-    monthly_active_accounts = execute_sql('''
-    SELECT * FROM BUNDLEBEAR.DBT_KOFI.ERC4337_OVERVIEW_ACTIVE_ACCOUNTS_METRIC
-    WHERE TIMEFRAME = '{time}'                                     
-    ORDER BY DATE
-    ''',
-                                          time=timeframe)
 
-    monthly_userops = execute_sql('''
-    SELECT * FROM BUNDLEBEAR.DBT_KOFI.ERC4337_OVERVIEW_USEROPS_METRIC
-    WHERE TIMEFRAME = '{time}'                                     
-    ORDER BY DATE
-    ''',
-                                          time=timeframe)
+def table_leaderboard(table, columns, value, label, **where):
+  # Leaderboard sections answered from the cached copy of `table`.
+  return leaderboard_sections(
+    "leaderboard", value, label,
+    lambda limit, after: submit_leaderboard(table, columns, value, label,
+                                            limit, after, **where),
+    lambda: submit_query(count_table, table, **where))
 
-    monthly_paymaster_spend = execute_sql('''
-    SELECT * FROM BUNDLEBEAR.DBT_KOFI.ERC4337_OVERVIEW_PAYMASTER_SPEND_METRIC
-    WHERE TIMEFRAME = '{time}'                                     
-    ORDER BY DATE
-    ''',
-                                          time=timeframe)
 
-    monthly_bundler_revenue = execute_sql('''
-    SELECT * FROM BUNDLEBEAR.DBT_KOFI.ERC4337_OVERVIEW_BUNDLER_REVENUE_METRIC
-    WHERE TIMEFRAME = '{time}'                                     
-    ORDER BY DATE
+def deployer_leaderboard(table):
+  # Leaderboard sections grouped in Snowflake; limit and cursor go into the
+  # query so only one page of factories is sent back.
+  def submit_page(limit, after):
+    having = ''
+    if after is not None:
+      count, factory = after[0] or 0, after[1]
+      if count != int(count):
+        # Account counts are whole; anything else is a forged cursor.
+        abort(400, description=f"Invalid cursor: {request.args['after']}")
+      count = int(count)
+      having = f"HAVING COUNT(*) < {count}"
+      if factory is not None:
+        # NULL names sort last, so they follow every named factory.
+        having += (f" OR (COUNT(*) = {count} AND (FACTORY_NAME > "
+                   f"{sql_literal(factory)} OR FACTORY_NAME IS NULL))")
+    return submit_sql('''
+    SELECT 
+    FACTORY_NAME AS DEPLOYER_NAME,
+    COUNT(*) AS NUM_ACCOUNTS
+    FROM BUNDLEBEAR.DBT_KOFI.{table}
+    GROUP BY 1
+    {having}
+    ORDER BY 2 DESC, 1
+    {limit}
     ''',
-                                          time=timeframe)
+                      table=table,
+                      having=having,
+                      limit=f"LIMIT {limit}" if limit else '')
 
-  else:
-    monthly_active_accounts = execute_sql('''
-    SELECT * FROM BUNDLEBEAR.DBT_KOFI.ERC4337_OVERVIEW_ACTIVE_ACCOUNTS_METRIC
-    WHERE TIMEFRAME = '{time}'
-    AND CHAIN = '{chain}'                                                                          
-    ORDER BY DATE
-    ''',
-                                          chain=chain,
-                                          time=timeframe)
-
-    monthly_userops = execute_sql('''
-    SELECT * FROM BUNDLEBEAR.DBT_KOFI.ERC4337_OVERVIEW_USEROPS_METRIC
-    WHERE TIMEFRAME = '{time}'     
-    AND CHAIN = '{chain}'                                                                 
-    ORDER BY DATE
-    ''',
-                                          chain=chain,
-                                          time=timeframe)
-
-    monthly_paymaster_spend = execute_sql('''
-    SELECT * FROM BUNDLEBEAR.DBT_KOFI.ERC4337_OVERVIEW_PAYMASTER_SPEND_METRIC
-    WHERE TIMEFRAME = '{time}'
-    AND CHAIN = '{chain}'                                        
-    ORDER BY DATE
-    ''',
-                                          chain=chain,
-                                          time=timeframe)
-
-    monthly_bundler_revenue = execute_sql('''
-    SELECT * FROM BUNDLEBEAR.DBT_KOFI.ERC4337_OVERVIEW_BUNDLER_REVENUE_METRIC
-    WHERE TIMEFRAME = '{time}' 
-    AND CHAIN = '{chain}'                                       
-    ORDER BY DATE
+  def submit_total():
+    total = submit_sql('''
+    SELECT COUNT(*) AS TOTAL
+    FROM (
+        SELECT FACTORY_NAME
+        FROM BUNDLEBEAR.DBT_KOFI.{table}
+        GROUP BY 1
+    )
     ''',
-                                           chain=chain,
-                                          time=timeframe)
-
-  response_data = {
-    "accounts": stat_accounts,
-    "userops": stat_userops,
-    "transactions": stat_txns,
-    "paymaster_spend": stat_paymaster_spend,
-    "monthly_active_accounts": monthly_active_accounts,
-    "monthly_userops": monthly_userops,
-    "monthly_paymaster_spend": monthly_paymaster_spend,
-    "monthly_bundler_revenue": monthly_bundler_revenue,
-    "accounts_by_category": accounts_by_category
-  }
+                       table=table)
+    return then(total, lambda rows: rows[0]["TOTAL"])
+
+  return leaderboard_sections("leaderboard", "NUM_ACCOUNTS", "DEPLOYER_NAME",
+                              submit_page, submit_total)
+
+
+def range_params():
+  dates = []
+  for name in RANGE_PARAMS:
+    value = request.args.get(name) or None
+    if value is not None:
+      try:
+        value = datetime.date.fromisoformat(value).isoformat()
+      except ValueError:
+        abort(400, description=f"{name} must be a date like 2024-01-31")
+    dates.append(value)
+  if None not in dates and dates[0] > dates[1]:
+    abort(400, description="from must not be after to")
+  return tuple(dates)
+
+
+def max_points_param():
+  max_points = request.args.get('max_points')
+  if not max_points:
+    return None
+  max_points = whole_number(max_points)
+  if max_points is None or max_points < 3:
+    abort(400, description="max_points must be a whole number of at least 3")
+  return max_points
+
+
+def top_params():
+  top, by = request.args.get('top'), request.args.get('top_by', 'total')
+  if top:
+    top = whole_number(top)
+    if top is None or top < 1:
+      abort(400, description="top must be a whole number of at least 1")
+  if by not in TOP_BY:
+    abort(400, description=f"top_by must be one of {', '.join(TOP_BY)}")
+  return (top, by) if top else None
+
+
+def bucketed(section, top, by):
+  # A breakdown chart shown as its `top` series plus 'other' by default.
+  section.top = (top, by)
+  return section
+
+
+def series_window(column, timeframe, since=None, until=None):
+  # WHERE condition on a BLOCK_TIME column for the charts aggregated in
+  # Snowflake: the last 24 months, or the buckets from `since` to `until`.
+  if since is None:
+    return f"{column} > DATE_TRUNC('{timeframe}', CURRENT_DATE()) - INTERVAL '24 months'"
+  condition = f"{column} >= '{since}'"
+  if until is not None:
+    condition += f" AND DATE_TRUNC('{timeframe}', {column}) <= '{until}'"
+  return condition
+
+
+def windowed(submit, timeframe):
+  # A chart over the last 24 months, built by submit(since, until). A ?from=
+  # older than that is pushed down as its own query instead of sliced.
+  def section():
+    return submit(None, None)
+
+  try:
+    start = period_start(months_before(period_start(datetime.date.today(),
+                                                    timeframe), 24), timeframe)
+  except ValueError:
+    return section
+  # The oldest bucket is partial, so it does not count as covered.
+  section.covers_from = (start + datetime.timedelta(days=1)).isoformat()
+  section.ranged = submit
+  return section
+
+
+def respond_sections(sections):
+  # Sections are callables returning a query future; only the ones named in
+  # ?sections= run. Each result is cached on its own under the route's data
+  # params, so full and partial requests reuse each other's sections. A
+  # ?from=/?to= range is cut out of the cached full series, ?top= keeps its
+  # largest series plus 'other' and ?max_points= thins each line of it.
+  names = requested_sections(request.args) or list(sections)
+  unknown = [name for name in names if name not in sections]
+  if unknown:
+    abort(400, description=f"Unknown sections: {', '.join(unknown)}; "
+                           f"available: {', '.join(sections)}")
+  response_format = format_param()
+  since, until = range_params()
+  max_points = max_points_param()
+  top = top_params()
+  # Each unknown chain or timeframe would otherwise get a cache entry of its
+  # own, indexed for rewarming.
+  route_params = {name: request.args.get(name, default)
+                  for name, default in ROUTE_PARAMS[request.path].items()}
+  if tuple(route_params.values()) not in route_param_values(request.path):
+    abort(400, description="No data for " + ', '.join(
+      f"{name}={value}" for name, value in route_params.items()))
+  params = canonical_params(request.path, request.args)
+  page = urlencode([(name, params.pop(name)) for name in PAGE_PARAMS])
+  for name in (*SHAPE_PARAMS, *RANGE_PARAMS):
+    params.pop(name)
+  key = build_cache_key(request.path, params)
+  calls, keys, variants = {}, {}, set()
+  for name in names:
+    section, keys[name] = sections[name], f"{key}#{name}"
+    if getattr(section, 'paged', False):
+      keys[name] += f"&{page}"
+      variants.add(name)
+    if since is not None and since < getattr(section, 'covers_from', since):
+      section = partial(section.ranged, since, until)
+      keys[name] += f"&{urlencode({'from': since, 'to': until or ''})}"
+      variants.add(name)
+    calls[name] = section
+  version = response_cache.version
+  cached = {} if is_cache_refresh() else response_cache.get_parts(
+    list(keys.values()))
+  results = {name: cached[keys[name]][0]
+             for name in names if keys[name] in cached}
+  # The page is only fresh as long as the oldest part it reuses.
+  fresh_until = min((cached[keys[name]][1] for name in results),
+                    default=math.inf)
+
+  missing = [name for name in names if name not in results]
+  if missing:
+    # Sections derived from the same query share one future.
+    token = (shared_queries.set((threading.RLock(), {}))
+             if shared_queries.get() is None else None)
+    try:
+      computed = gather({name: calls[name]() for name in missing})
+    finally:
+      if token is not None:
+        shared_queries.reset(token)
+    response_cache.set_parts({keys[name]: computed[name] for name in missing
+                              if name not in variants}, version)
+    response_cache.set_parts({keys[name]: computed[name] for name in missing
+                              if name in variants}, version, variant=True)
+    results.update(computed)
+  response_data = {}
+  for name in names:
+    rows = slice_dates(results[name], since, until)
+    rows = top_n(rows, *(top or getattr(sections[name], 'top', (None,))))
+    response_data[name] = downsample(rows, max_points)
+  response = respond(response_data, response_format)
+  if fresh_until != math.inf:
+    response.cache_control.max_age = max(0, int(fresh_until - time.time()))
+  return response
+
+
+@app.errorhandler(TimeoutError)
+def handle_timeout(e):
+  return jsonify(error=str(e)), 504
+
+@app.before_request
+def set_metrics_route():
+  metrics.route.set(request.url_rule.rule if request.url_rule else 'unmatched')
 
-  return jsonify(response_data)
+@app.before_request
+def start_timing():
+  if SERVER_TIMING or REQUEST_TIMING_LOG:
+    timing.start()
+
+@app.after_request
+def add_server_timing(response):
+  timings = timing.current()
+  if timings is None:
+    return response
+  # Time spent in the view itself, outside queries and JSON encoding, such
+  # as the row loops that reshape query results.
+  view = timings.get('view')
+  if view:
+    timings.add('process', max(0.0, view - timings.get('queries') -
+                               timings.get('json')))
+  timings.add('total', timings.total())
+  if SERVER_TIMING:
+    response.headers['Server-Timing'] = timings.header()
+  if REQUEST_TIMING_LOG:
+    app.logger.info(json.dumps({
+      'path': request.path,
+      'query': request.query_string.decode(),
+      'status': response.status_code,
+      'timings_ms': {name: round(seconds * 1000, 1)
+                     for name, (seconds, _) in timings.phases.items()},
+    }))
+  return response
+
+@app.teardown_request
+def stop_timing(exc):
+  timing.stop()
+
+traffic_capture = (TrafficCapture(TRAFFIC_CAPTURE_PATH,
+                                  TRAFFIC_CAPTURE_SAMPLE_RATE)
+                   if TRAFFIC_CAPTURE_PATH else None)
+
+@app.before_request
+def start_capture():
+  if traffic_capture is not None and traffic_capture.sampled():
+    g.capture_started = time.perf_counter()
+
+@app.after_request
+def finish_capture(response):
+  # Which tier answered: local, redis or miss (computed for this request).
+  if 'cache_result' in g:
+    response.headers['X-Cache'] = g.cache_result
+  if 'capture_started' in g:
+    traffic_capture.record({
+      'ts': time.time(),
+      'route': request.path,
+      'args': request.args.to_dict(),
+      'status': response.status_code,
+      'cache': g.get('cache_result'),
+      'latency_ms': round((time.perf_counter() - g.capture_started) * 1000, 3),
+    })
+  return response
+
+PROTECTED_ENDPOINTS = ['account_deployer', 'cache_stats', 'prometheus_metrics']
+
+@app.before_request
+def check_auth():
+    if request.endpoint not in PROTECTED_ENDPOINTS:
+        return None
+
+    # Get the password from the request header
+    provided_password = request.headers.get('X-API-Password')
+    
+    # Check if password matches
+    if provided_password != API_PASSWORD:
+        abort(401, description="Unauthorized: Invalid or missing API password")
+
+@app.route('/cache-stats')
+def cache_stats():
+  # Counters are per worker; repeated calls may land on different workers.
+  return jsonify(response_cache.info())
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+  data, content_type = metrics.render()
+  return app.response_class(data, content_type=content_type)
+
+
+@app.route('/overview')
+@cached_view
+def index():
+  chain = request.args.get('chain', 'all')
+  timeframe = request.args.get('timeframe', 'week')
+
+  def summary_stat(column):
+    summary_stats = submit_table('ERC4337_OVERVIEW_SUMMARY_STATS_METRIC',
+                                 order_by=(), CHAIN=chain)
+    return then(summary_stats, lambda rows: [{column: rows[0][column]}])
+
+  # With chain=all the monthly charts return every chain's rows.
+  chain_filter = {} if chain == 'all' else {'CHAIN': chain}
+
+  return respond_sections({
+    "accounts": lambda: summary_stat("NUM_ACCOUNTS"),
+    "userops": lambda: summary_stat("NUM_USEROPS"),
+    "transactions": lambda: summary_stat("NUM_TXNS"),
+    "paymaster_spend": lambda: summary_stat("GAS_SPENT"),
+    "monthly_active_accounts": lambda: submit_table(
+      'ERC4337_OVERVIEW_ACTIVE_ACCOUNTS_METRIC',
+      TIMEFRAME=timeframe, **chain_filter),
+    "monthly_userops": lambda: submit_table(
+      'ERC4337_OVERVIEW_USEROPS_METRIC',
+      TIMEFRAME=timeframe, **chain_filter),
+    "monthly_paymaster_spend": lambda: submit_table(
+      'ERC4337_OVERVIEW_PAYMASTER_SPEND_METRIC',
+      TIMEFRAME=timeframe, **chain_filter),
+    "monthly_bundler_revenue": lambda: submit_table(
+      'ERC4337_OVERVIEW_BUNDLER_REVENUE_METRIC',
+      TIMEFRAME=timeframe, **chain_filter),
+    "accounts_by_category": lambda: submit_table(
+      'ERC4337_OVERVIEW_ACCOUNTS_BY_CATEGORY_METRIC',
+      TIMEFRAME=timeframe, CHAIN=chain),
+  })
 
 
 @app.route('/bundler')
-@cache.memoize(make_name=make_cache_key)
+@cached_view
 def bundler():
   chain = request.args.get('chain', 'all')
   timeframe = request.args.get('timeframe', 'week')
 
-  leaderboard = execute_sql('''
-  SELECT 
-  BUNDLER_NAME,
-  NUM_USEROPS,
-  NUM_TXNS,
-  REVENUE
-  FROM BUNDLEBEAR.DBT_KOFI.ERC4337_BUNDLER_LEADERBOARD_METRIC
-  WHERE CHAIN = '{chain}'
-  ORDER BY 2 DESC
-  ''', chain=chain)
-
-  userops_chart = execute_sql('''
-  SELECT
-  DATE,
-  BUNDLER_NAME,
-  NUM_USEROPS
-  FROM BUNDLEBEAR.DBT_KOFI.ERC4337_BUNDLER_USEROPS_METRIC
-  WHERE CHAIN = '{chain}'
-  AND TIMEFRAME = '{time}'
-  ORDER BY 1
-  ''',
-                                           chain=chain,
-                                          time=timeframe)
-  
-  revenue_chart = execute_sql('''
-  SELECT
-  DATE,
-  BUNDLER_NAME,
-  REVENUE
-  FROM BUNDLEBEAR.DBT_KOFI.ERC4337_BUNDLER_REVENUE_METRIC
-  WHERE CHAIN = '{chain}'
-  AND TIMEFRAME = '{time}'
-  ORDER BY 1
-  ''',
-                                           chain=chain,
-                                          time=timeframe)
-  
-  multi_userop_chart = execute_sql('''
-  SELECT
-  DATE,
-  PCT_MULTI_USEROP
-  FROM BUNDLEBEAR.DBT_KOFI.ERC4337_BUNDLER_MULTIOP_METRIC
-  WHERE CHAIN = '{chain}'
-  AND TIMEFRAME = '{time}'
-  ORDER BY 1
-  ''',
-                                           chain=chain,
-                                          time=timeframe)
-  
-  accounts_chart = execute_sql('''
-  SELECT
-  DATE,
-  BUNDLER_NAME,
-  NUM_ACCOUNTS
-  FROM BUNDLEBEAR.DBT_KOFI.ERC4337_BUNDLER_ACCOUNTS_METRIC
-  WHERE CHAIN = '{chain}'
-  AND TIMEFRAME = '{time}'
-  ORDER BY 1
-  ''',
-                                           chain=chain,
-                                          time=timeframe)
-  
-  frontrun_chart = execute_sql('''
-  SELECT
-  DATE,
-  BUNDLER_NAME,
-  NUM_BUNDLES
-  FROM BUNDLEBEAR.DBT_KOFI.ERC4337_BUNDLER_FRONTRUN_METRIC
-  WHERE CHAIN = '{chain}'
-  AND TIMEFRAME = '{time}'
-  ORDER BY 1
-  ''',
-                                           chain=chain,
-                                          time=timeframe)
-  
-  frontrun_pct_chart = execute_sql('''
-  SELECT
-  DATE,
-  PCT_FRONTRUN
-  FROM BUNDLEBEAR.DBT_KOFI.ERC4337_BUNDLER_FRONTRUN_PCT_METRIC
-  WHERE CHAIN = '{chain}'
-  AND TIMEFRAME = '{time}'
-  ORDER BY 1
-  ''',
-                                           chain=chain,
-                                          time=timeframe)                            
-
-  response_data = {
-    "leaderboard": leaderboard,
-    "userops_chart": userops_chart,
-    "revenue_chart": revenue_chart,
-    "multi_userop_chart": multi_userop_chart,
-    "accounts_chart": accounts_chart,
-    "frontrun_chart": frontrun_chart,
-    "frontrun_pct_chart": frontrun_pct_chart
-  }
-
-  return jsonify(response_data)
+  return respond_sections({
+    **table_leaderboard(
+      'ERC4337_BUNDLER_LEADERBOARD_METRIC',
+      ['BUNDLER_NAME', 'NUM_USEROPS', 'NUM_TXNS', 'REVENUE'],
+      'NUM_USEROPS', 'BUNDLER_NAME', CHAIN=chain),
+    "userops_chart": lambda: submit_table(
+      'ERC4337_BUNDLER_USEROPS_METRIC',
+      ['DATE', 'BUNDLER_NAME', 'NUM_USEROPS'],
+      CHAIN=chain, TIMEFRAME=timeframe),
+    "revenue_chart": lambda: submit_table(
+      'ERC4337_BUNDLER_REVENUE_METRIC',
+      ['DATE', 'BUNDLER_NAME', 'REVENUE'],
+      CHAIN=chain, TIMEFRAME=timeframe),
+    "multi_userop_chart": lambda: submit_table(
+      'ERC4337_BUNDLER_MULTIOP_METRIC',
+      ['DATE', 'PCT_MULTI_USEROP'],
+      CHAIN=chain, TIMEFRAME=timeframe),
+    "accounts_chart": lambda: submit_table(
+      'ERC4337_BUNDLER_ACCOUNTS_METRIC',
+      ['DATE', 'BUNDLER_NAME', 'NUM_ACCOUNTS'],
+      CHAIN=chain, TIMEFRAME=timeframe),
+    "frontrun_chart": lambda: submit_table(
+      'ERC4337_BUNDLER_FRONTRUN_METRIC',
+      ['DATE', 'BUNDLER_NAME', 'NUM_BUNDLES'],
+      CHAIN=chain, TIMEFRAME=timeframe),
+    "frontrun_pct_chart": lambda: submit_table(
+      'ERC4337_BUNDLER_FRONTRUN_PCT_METRIC',
+      ['DATE', 'PCT_FRONTRUN'],
+      CHAIN=chain, TIMEFRAME=timeframe),
+  })
 
 
 @app.route('/paymaster')
-@cache.memoize(make_name=make_cache_key)
+@cached_view
 def paymaster():
   chain = request.args.get('chain', 'all')
   timeframe = request.args.get('timeframe', 'week')
 
-  leaderboard = execute_sql('''
-  SELECT 
-  PAYMASTER_NAME,
-  NUM_USEROPS,
-  GAS_SPENT
-  FROM BUNDLEBEAR.DBT_KOFI.ERC4337_PAYMASTER_LEADERBOARD_METRIC
-  WHERE CHAIN = '{chain}'
-  ORDER BY 3 DESC
-  ''', chain=chain)
-
-  userops_chart = execute_sql('''
-  SELECT
-  DATE,
-  PAYMASTER_NAME,
-  NUM_USEROPS
-  FROM BUNDLEBEAR.DBT_KOFI.ERC4337_PAYMASTER_USEROPS_METRIC
-  WHERE CHAIN = '{chain}'
-  AND TIMEFRAME = '{time}'
-  ORDER BY 1
-  ''',
-                                           chain=chain,
-                                          time=timeframe)
-  
-  spend_chart = execute_sql('''
-  SELECT
-  DATE,
-  PAYMASTER_NAME,
-  GAS_SPENT
-  FROM BUNDLEBEAR.DBT_KOFI.ERC4337_PAYMASTER_SPEND_METRIC
-  WHERE CHAIN = '{chain}'
-  AND TIMEFRAME = '{time}'
-  ORDER BY 1
-  ''',
-                                           chain=chain,
-                                          time=timeframe)
-  
-  accounts_chart = execute_sql('''
-  SELECT
-  DATE,
-  PAYMASTER_NAME,
-  NUM_ACCOUNTS
-  FROM BUNDLEBEAR.DBT_KOFI.ERC4337_PAYMASTER_ACCOUNTS_METRIC
-  WHERE CHAIN = '{chain}'
-  AND TIMEFRAME = '{time}'
-  ORDER BY 1
-  ''',
-                                           chain=chain,
-                                          time=timeframe)
-  
-  spend_type_chart = execute_sql('''
-  SELECT
-  DATE,
-  PAYMASTER_TYPE,
-  GAS_SPENT
-  FROM BUNDLEBEAR.DBT_KOFI.ERC4337_PAYMASTER_SPEND_TYPE_METRIC
-  WHERE CHAIN = '{chain}'
-  AND TIMEFRAME = '{time}'
-  ORDER BY 1
-  ''',
-                                           chain=chain,
-                                          time=timeframe)
-
-  response_data = {
-    "leaderboard": leaderboard,
-    "userops_chart": userops_chart,
-    "spend_chart": spend_chart,
-    "accounts_chart": accounts_chart,
-    "spend_type_chart": spend_type_chart
-  }
-
-  return jsonify(response_data)
+  return respond_sections({
+    **table_leaderboard(
+      'ERC4337_PAYMASTER_LEADERBOARD_METRIC',
+      ['PAYMASTER_NAME', 'NUM_USEROPS', 'GAS_SPENT'],
+      'GAS_SPENT', 'PAYMASTER_NAME', CHAIN=chain),
+    "userops_chart": lambda: submit_table(
+      'ERC4337_PAYMASTER_USEROPS_METRIC',
+      ['DATE', 'PAYMASTER_NAME', 'NUM_USEROPS'],
+      CHAIN=chain, TIMEFRAME=timeframe),
+    "spend_chart": lambda: submit_table(
+      'ERC4337_PAYMASTER_SPEND_METRIC',
+      ['DATE', 'PAYMASTER_NAME', 'GAS_SPENT'],
+      CHAIN=chain, TIMEFRAME=timeframe),
+    "accounts_chart": lambda: submit_table(
+      'ERC4337_PAYMASTER_ACCOUNTS_METRIC',
+      ['DATE', 'PAYMASTER_NAME', 'NUM_ACCOUNTS'],
+      CHAIN=chain, TIMEFRAME=timeframe),
+    "spend_type_chart": lambda: submit_table(
+      'ERC4337_PAYMASTER_SPEND_TYPE_METRIC',
+      ['DATE', 'PAYMASTER_TYPE', 'GAS_SPENT'],
+      CHAIN=chain, TIMEFRAME=timeframe),
+  })
 
 
 @app.route('/account_deployer')
-@cache.memoize(make_name=make_cache_key)
+@cached_view
 def account_deployer():
   chain = request.args.get('chain', 'all')
   timeframe = request.args.get('timeframe', 'week')
 
   if chain == 'all':
-    leaderboard = execute_sql('''
-    SELECT 
-    FACTORY_NAME AS DEPLOYER_NAME,
-    COUNT(*) AS NUM_ACCOUNTS
-    FROM BUNDLEBEAR.DBT_KOFI.ERC4337_ALL_ACCOUNT_DEPLOYMENTS
-    GROUP BY 1
-    ORDER BY 2 DESC
-    ''')
-
-    deployments_chart = execute_sql('''
-    SELECT 
-    TO_VARCHAR(date_trunc('{time}', BLOCK_TIME), 'YYYY-MM-DD') as DATE,
-    FACTORY_NAME AS DEPLOYER_NAME,
-    COUNT(*) AS NUM_ACCOUNTS
-    FROM BUNDLEBEAR.DBT_KOFI.ERC4337_ALL_ACCOUNT_DEPLOYMENTS
-    WHERE BLOCK_TIME > DATE_TRUNC('{time}', CURRENT_DATE()) - INTERVAL '24 months'
-    GROUP BY 1,2
-    ORDER BY 1
-    ''',
-                                    time=timeframe)
-
-    accounts_chart = execute_sql('''
-    SELECT
-        TO_VARCHAR(date_trunc('{time}', BLOCK_TIME), 'YYYY-MM-DD') as DATE,
-        FACTORY_NAME,
-        COUNT(DISTINCT SENDER) AS NUM_ACCOUNTS
-    FROM (
-        SELECT
-            u.BLOCK_TIME,
-            COALESCE(l.name, 'Unknown') AS FACTORY_NAME, 
-            u.SENDER
-        FROM BUNDLEBEAR.DBT_KOFI.ERC4337_ALL_USEROPS u
-        INNER JOIN BUNDLEBEAR.DBT_KOFI.ERC4337_ALL_ACCOUNT_DEPLOYMENTS ad
-            ON ad.ACCOUNT_ADDRESS = u.SENDER
-            AND ad.CHAIN = u.CHAIN
-        LEFT JOIN BUNDLEBEAR.DBT_KOFI.ERC4337_LABELS_FACTORIES l
-            ON l.ADDRESS = ad.FACTORY
-        WHERE u.BLOCK_TIME > DATE_TRUNC('{time}', CURRENT_DATE()) - INTERVAL '24 months'
-    ) AS combined_data
-    GROUP BY 1, 2
-    ORDER BY 1, 2;
-    ''',
-                                 time=timeframe)
-
-    response_data = {
-      "leaderboard": leaderboard,
-      "deployments_chart": deployments_chart,
-      "accounts_chart": accounts_chart
-    }
-
-    return jsonify(response_data)
+    def deployments_chart(since, until):
+      return submit_sql('''
+      SELECT 
+      TO_VARCHAR(date_trunc('{time}', BLOCK_TIME), 'YYYY-MM-DD') as DATE,
+      FACTORY_NAME AS DEPLOYER_NAME,
+      COUNT(*) AS NUM_ACCOUNTS
+      FROM BUNDLEBEAR.DBT_KOFI.ERC4337_ALL_ACCOUNT_DEPLOYMENTS
+      WHERE {window}
+      GROUP BY 1,2
+      ORDER BY 1
+      ''',
+                        time=timeframe,
+                        window=series_window('BLOCK_TIME', timeframe, since,
+                                             until))
+
+    def accounts_chart(since, until):
+      return submit_accounts_chart('''
+      SELECT
+          TO_VARCHAR(date_trunc('{time}', BLOCK_TIME), 'YYYY-MM-DD') as DATE,
+          FACTORY_NAME,
+          COUNT(DISTINCT SENDER) AS NUM_ACCOUNTS
+      FROM (
+          SELECT
+              u.BLOCK_TIME,
+              COALESCE(l.name, 'Unknown') AS FACTORY_NAME, 
+              u.SENDER
+          FROM BUNDLEBEAR.DBT_KOFI.ERC4337_ALL_USEROPS u
+          INNER JOIN BUNDLEBEAR.DBT_KOFI.ERC4337_ALL_ACCOUNT_DEPLOYMENTS ad
+              ON ad.ACCOUNT_ADDRESS = u.SENDER
+              AND ad.CHAIN = u.CHAIN
+          LEFT JOIN BUNDLEBEAR.DBT_KOFI.ERC4337_LABELS_FACTORIES l
+              ON l.ADDRESS = ad.FACTORY
+          WHERE {window}
+      ) AS combined_data
+      GROUP BY 1, 2
+      ORDER BY 1, 2;
+      ''',
+                                   since,
+                                   until,
+                                   time=timeframe)
+
+    return respond_sections({
+      **deployer_leaderboard('ERC4337_ALL_ACCOUNT_DEPLOYMENTS'),
+      "deployments_chart": windowed(deployments_chart, timeframe),
+      "accounts_chart": windowed(accounts_chart, timeframe),
+    })
 
   else:
-    leaderboard = execute_sql('''
-    SELECT 
-    FACTORY_NAME AS DEPLOYER_NAME,
-    COUNT(*) AS NUM_ACCOUNTS
-    FROM BUNDLEBEAR.DBT_KOFI.ERC4337_{chain}_ACCOUNT_DEPLOYMENTS
-    GROUP BY 1
-    ORDER BY 2 DESC
-    ''',
-                              chain=chain)
-
-    deployments_chart = execute_sql('''
-    SELECT 
-    TO_VARCHAR(date_trunc('{time}', BLOCK_TIME), 'YYYY-MM-DD') as DATE,
-    FACTORY_NAME AS DEPLOYER_NAME,
-    COUNT(*) AS NUM_ACCOUNTS
-    FROM BUNDLEBEAR.DBT_KOFI.ERC4337_{chain}_ACCOUNT_DEPLOYMENTS
-    WHERE BLOCK_TIME > DATE_TRUNC('{time}', CURRENT_DATE()) - INTERVAL '24 months'
-    GROUP BY 1,2
-    ORDER BY 1
-    ''',
-                                    chain=chain,
-                                    time=timeframe)
-
-    accounts_chart = execute_sql('''
-    SELECT
-        TO_VARCHAR(date_trunc('{time}', u.BLOCK_TIME), 'YYYY-MM-DD') as DATE,
-        COALESCE(l.name, 'Unknown') AS FACTORY_NAME, 
-        COUNT(DISTINCT u.SENDER) AS NUM_ACCOUNTS
-    FROM BUNDLEBEAR.DBT_KOFI.ERC4337_{chain}_USEROPS u
-    INNER JOIN BUNDLEBEAR.DBT_KOFI.ERC4337_{chain}_ACCOUNT_DEPLOYMENTS ad
-        ON ad.ACCOUNT_ADDRESS = u.SENDER
-    LEFT JOIN BUNDLEBEAR.DBT_KOFI.ERC4337_LABELS_FACTORIES l
-        ON l.ADDRESS = ad.FACTORY
-    WHERE u.BLOCK_TIME > DATE_TRUNC('{time}', CURRENT_DATE()) - INTERVAL '24 months'
-    GROUP BY 1, 2
-    ORDER BY 1, 2
-    ''',
-                                 chain=chain,
-                                 time=timeframe)
-
-    response_data = {
-      "leaderboard": leaderboard,
-      "deployments_chart": deployments_chart,
-      "accounts_chart": accounts_chart
-    }
-
-    return jsonify(response_data)
+    def deployments_chart(since, until):
+      return submit_sql('''
+      SELECT 
+      TO_VARCHAR(date_trunc('{time}', BLOCK_TIME), 'YYYY-MM-DD') as DATE,
+      FACTORY_NAME AS DEPLOYER_NAME,
+      COUNT(*) AS NUM_ACCOUNTS
+      FROM BUNDLEBEAR.DBT_KOFI.ERC4337_{chain}_ACCOUNT_DEPLOYMENTS
+      WHERE {window}
+      GROUP BY 1,2
+      ORDER BY 1
+      ''',
+                        chain=chain,
+                        time=timeframe,
+                        window=series_window('BLOCK_TIME', timeframe, since,
+                                             until))
+
+    def accounts_chart(since, until):
+      return submit_accounts_chart('''
+      SELECT
+          TO_VARCHAR(date_trunc('{time}', u.BLOCK_TIME), 'YYYY-MM-DD') as DATE,
+          COALESCE(l.name, 'Unknown') AS FACTORY_NAME, 
+          COUNT(DISTINCT u.SENDER) AS NUM_ACCOUNTS
+      FROM BUNDLEBEAR.DBT_KOFI.ERC4337_{chain}_USEROPS u
+      INNER JOIN BUNDLEBEAR.DBT_KOFI.ERC4337_{chain}_ACCOUNT_DEPLOYMENTS ad
+          ON ad.ACCOUNT_ADDRESS = u.SENDER
+      LEFT JOIN BUNDLEBEAR.DBT_KOFI.ERC4337_LABELS_FACTORIES l
+          ON l.ADDRESS = ad.FACTORY
+      WHERE {window}
+      GROUP BY 1, 2
+      ORDER BY 1, 2
+      ''',
+                                   since,
+                                   until,
+                                   chain=chain,
+                                   time=timeframe)
+
+    return respond_sections({
+      **deployer_leaderboard(f"ERC4337_{chain}_ACCOUNT_DEPLOYMENTS"),
+      "deployments_chart": windowed(deployments_chart, timeframe),
+      "accounts_chart": windowed(accounts_chart, timeframe),
+    })
 
 
 @app.route('/apps')
-@cache.memoize(make_name=make_cache_key)
+@cached_view
 def apps():
   chain = request.args.get('chain', 'all')
   timeframe = request.args.get('timeframe', 'week')
 
-  usage_chart = execute_sql('''
-  SELECT
-  DATE,
-  PROJECT,
-  NUM_UNIQUE_SENDERS
-  FROM BUNDLEBEAR.DBT_KOFI.ERC4337_APPS_USAGE_METRIC
-  WHERE CHAIN = '{chain}'
-  AND TIMEFRAME = '{time}'
-  ORDER BY 1,3
-  ''',
-                                           chain=chain,
-                                          time=timeframe)
-  
-  ops_chart = execute_sql('''
-  SELECT
-  DATE,
-  PROJECT,
-  NUM_OPS
-  FROM BUNDLEBEAR.DBT_KOFI.ERC4337_APPS_OPS_METRIC
-  WHERE CHAIN = '{chain}'
-  AND TIMEFRAME = '{time}'
-  ORDER BY 1,3
-  ''',
-                                           chain=chain,
-                                          time=timeframe)
-  
-  leaderboard = execute_sql('''
-  SELECT
-  PROJECT,
-  NUM_UNIQUE_SENDERS,
-  NUM_OPS
-  FROM BUNDLEBEAR.DBT_KOFI.ERC4337_APPS_LEADERBOARD_METRIC
-  WHERE CHAIN = '{chain}'
-  ORDER BY 2 DESC
-  ''',
-                                           chain=chain)
-
-  response_data = {
-    "usage_chart": usage_chart,
-    "leaderboard": leaderboard,
-    "ops_chart": ops_chart
-  }
-
-  return jsonify(response_data)
+  return respond_sections({
+    "usage_chart": lambda: submit_table(
+      'ERC4337_APPS_USAGE_METRIC',
+      ['DATE', 'PROJECT', 'NUM_UNIQUE_SENDERS'],
+      order_by=['DATE', 'NUM_UNIQUE_SENDERS'],
+      CHAIN=chain, TIMEFRAME=timeframe),
+    **table_leaderboard(
+      'ERC4337_APPS_LEADERBOARD_METRIC',
+      ['PROJECT', 'NUM_UNIQUE_SENDERS', 'NUM_OPS'],
+      'NUM_UNIQUE_SENDERS', 'PROJECT', CHAIN=chain),
+    "ops_chart": lambda: submit_table(
+      'ERC4337_APPS_OPS_METRIC',
+      ['DATE', 'PROJECT', 'NUM_OPS'],
+      order_by=['DATE', 'NUM_OPS'],
+      CHAIN=chain, TIMEFRAME=timeframe),
+  })
 
 
 @app.route('/eip7702-overview')
-@cache.memoize(make_name=make_cache_key)
+@cached_view
 def eip7702_overview():
   chain = request.args.get('chain', 'all')
   timeframe = request.args.get('timeframe', 'week')
 
-  summary_stats = execute_sql('''
-  SELECT 
-  LIVE_SMART_WALLETS,
-  NUM_AUTHORIZATIONS,
-  NUM_SET_CODE_TXNS
-  FROM BUNDLEBEAR.DBT_KOFI.EIP7702_METRICS_TOTAL_SUMMARY
-  WHERE CHAIN = '{chain}'
-  ''',chain=chain)
-
-  stat_live_smart_wallets = [{ "LIVE_SMART_WALLETS": summary_stats[0]["LIVE_SMART_WALLETS"] }]
-
-  stat_authorizations = [{"NUM_AUTHORIZATIONS": summary_stats[0]["NUM_AUTHORIZATIONS"]}]
-
-  stat_set_code_txns = [{"NUM_SET_CODE_TXNS": summary_stats[0]["NUM_SET_CODE_TXNS"]}]
-
-  smart_wallet_actions_type = execute_sql('''
-  SELECT
-  DATE,
-  TYPE,
-  NUM_ACTIONS
-  FROM BUNDLEBEAR.DBT_KOFI.EIP7702_OVERVIEW_ACTIONS_TYPE_METRIC
-  WHERE TIMEFRAME = '{time}'
-  AND CHAIN = '{chain}'
-  ORDER BY 1 
-  ''', time=timeframe,chain=chain)
+  def summary_stat(column):
+    summary_stats = submit_table('EIP7702_METRICS_TOTAL_SUMMARY',
+                                 ['LIVE_SMART_WALLETS', 'NUM_AUTHORIZATIONS',
+                                  'NUM_SET_CODE_TXNS'],
+                                 order_by=(), CHAIN=chain)
+    return then(summary_stats, lambda rows: [{column: rows[0][column]}])
 
+  # With chain=all the charts return every chain's rows, labelled by CHAIN.
   if chain == 'all':
-    activity_query = execute_sql('''
-    SELECT 
-    DATE,
-    CHAIN,
-    NUM_AUTHORIZATIONS,
-    NUM_SET_CODE_TXNS
-    FROM BUNDLEBEAR.DBT_KOFI.EIP7702_OVERVIEW_ACTIVITY_METRIC
-    WHERE TIMEFRAME = '{time}'
-    ORDER BY 1
-    ''',time=timeframe)
-
-    authorizations_chart = []
-    for row in activity_query:
-      authorizations_chart.append({
-          "DATE": row["DATE"],
-          "CHAIN": row["CHAIN"],
-          "NUM_AUTHORIZATIONS": row["NUM_AUTHORIZATIONS"]
-      })
-
-    set_code_chart = []
-    for row in activity_query:
-      set_code_chart.append({
-            "DATE": row["DATE"],
-            "CHAIN": row["CHAIN"],
-            "NUM_SET_CODE_TXNS": row["NUM_SET_CODE_TXNS"]
-        })
-
-    state_query = execute_sql('''
-    SELECT
-    TO_VARCHAR(DAY, 'YYYY-MM-DD') AS DATE,
-    CHAIN,
-    LIVE_SMART_WALLETS,
-    LIVE_AUTHORIZED_CONTRACTS
-    FROM BUNDLEBEAR.DBT_KOFI.EIP7702_METRICS_DAILY_AUTHORITY_STATE
-    WHERE CHAIN != 'cross-chain'
-    ORDER BY 1
-    ''')
-
-    live_smart_wallets_chart = []
-    for row in state_query:
-      live_smart_wallets_chart.append({
-          "DATE": row["DATE"],
-          "CHAIN": row["CHAIN"],
-          "LIVE_SMART_WALLETS": row["LIVE_SMART_WALLETS"]
-      })
-
-    live_authorized_contracts_chart = []
-    for row in state_query:
-      live_authorized_contracts_chart.append({
-            "DATE": row["DATE"],
-            "CHAIN": row["CHAIN"],
-            "LIVE_AUTHORIZED_CONTRACTS": row["LIVE_AUTHORIZED_CONTRACTS"]
-        })
-
-    active_smart_wallets_chart = execute_sql('''
-    SELECT
-    DATE,
-    CHAIN,
-    ACTIVE_ACCOUNTS
-    FROM BUNDLEBEAR.DBT_KOFI.EIP7702_OVERVIEW_ACTIVE_WALLETS_METRIC
-    WHERE TIMEFRAME = '{time}'
-    ORDER BY 1 
-    ''', time=timeframe)
-
-    smart_wallet_actions = execute_sql('''
-    SELECT
-    DATE,
-    CHAIN,
-    NUM_ACTIONS
-    FROM BUNDLEBEAR.DBT_KOFI.EIP7702_OVERVIEW_ACTIONS_METRIC
-    WHERE TIMEFRAME = '{time}'
-    ORDER BY 1 
-    ''', time=timeframe)
-
+    chain_columns, chain_filter = ['CHAIN'], {}
   else:
-    activity_query = execute_sql('''                               
-    SELECT 
-    DATE,
-    NUM_AUTHORIZATIONS,
-    NUM_SET_CODE_TXNS
-    FROM BUNDLEBEAR.DBT_KOFI.EIP7702_OVERVIEW_ACTIVITY_METRIC
-    WHERE CHAIN = '{chain}'
-    AND TIMEFRAME = '{time}'
-    ORDER BY 1
-    ''',chain=chain,time=timeframe)
-
-    authorizations_chart = []
-    for row in activity_query:
-        authorizations_chart.append({
-            "DATE": row["DATE"],
-            "NUM_AUTHORIZATIONS": row["NUM_AUTHORIZATIONS"]
-        })
-
-    set_code_chart = []
-    for row in activity_query:
-      set_code_chart.append({
-            "DATE": row["DATE"],
-            "NUM_SET_CODE_TXNS": row["NUM_SET_CODE_TXNS"]
-        })
-
-    state_query = execute_sql('''
-    SELECT
-    TO_VARCHAR(DAY, 'YYYY-MM-DD') AS DATE,
-    LIVE_SMART_WALLETS,
-    LIVE_AUTHORIZED_CONTRACTS
-    FROM BUNDLEBEAR.DBT_KOFI.EIP7702_METRICS_DAILY_AUTHORITY_STATE
-    WHERE CHAIN = '{chain}'
-    ORDER BY 1
-    ''', chain=chain)
-
-    live_smart_wallets_chart = []
-    for row in state_query:
-      live_smart_wallets_chart.append({
-          "DATE": row["DATE"],
-          "LIVE_SMART_WALLETS": row["LIVE_SMART_WALLETS"]
-      })
-
-    live_authorized_contracts_chart = []
-    for row in state_query:
-      live_authorized_contracts_chart.append({
-            "DATE": row["DATE"],
-            "LIVE_AUTHORIZED_CONTRACTS": row["LIVE_AUTHORIZED_CONTRACTS"]
-        })
-
-    active_smart_wallets_chart = execute_sql('''
-    SELECT
-    DATE,
-    ACTIVE_ACCOUNTS
-    FROM BUNDLEBEAR.DBT_KOFI.EIP7702_OVERVIEW_ACTIVE_WALLETS_METRIC
-    WHERE TIMEFRAME = '{time}'
-    AND CHAIN = '{chain}'
-    ORDER BY 1 
-    ''', time=timeframe, chain=chain)
-
-    smart_wallet_actions = execute_sql('''
-    SELECT
-    DATE,
-    NUM_ACTIONS
-    FROM BUNDLEBEAR.DBT_KOFI.EIP7702_OVERVIEW_ACTIONS_METRIC
-    WHERE TIMEFRAME = '{time}'
-    AND CHAIN = '{chain}'
-    ORDER BY 1 
-    ''', time=timeframe, chain=chain)
-
-  response_data = {
-    "stat_live_smart_wallets": stat_live_smart_wallets,
-    "stat_authorizations": stat_authorizations,
-    "stat_set_code_txns": stat_set_code_txns,
-    "authorizations_chart": authorizations_chart,
-    "set_code_chart": set_code_chart,
-    "live_smart_wallets_chart": live_smart_wallets_chart,
-    "live_authorized_contracts_chart": live_authorized_contracts_chart,
-    "active_smart_wallets_chart": active_smart_wallets_chart,
-    "smart_wallet_actions": smart_wallet_actions,
-    "smart_wallet_actions_type": smart_wallet_actions_type
-  }
-
-  return jsonify(response_data)
+    chain_columns, chain_filter = [], {'CHAIN': chain}
+
+  def state_chart(column):
+    state_query = submit_table(
+      'EIP7702_METRICS_DAILY_AUTHORITY_STATE',
+      ['DAY', 'CHAIN', 'LIVE_SMART_WALLETS', 'LIVE_AUTHORIZED_CONTRACTS'],
+      order_by=('DAY',), **chain_filter)
+
+    def chart(rows):
+      # The rows are shared with the other state chart, so build new ones.
+      return [{
+        "DATE": row["DAY"].strftime('%Y-%m-%d'),
+        **{name: row[name] for name in chain_columns},
+        column: row[column]
+      } for row in rows if chain != 'all' or row["CHAIN"] != 'cross-chain']
+
+    return then(state_query, chart)
+
+  return respond_sections({
+    "stat_live_smart_wallets": lambda: summary_stat("LIVE_SMART_WALLETS"),
+    "stat_authorizations": lambda: summary_stat("NUM_AUTHORIZATIONS"),
+    "stat_set_code_txns": lambda: summary_stat("NUM_SET_CODE_TXNS"),
+    "live_smart_wallets_chart": lambda: state_chart("LIVE_SMART_WALLETS"),
+    "live_authorized_contracts_chart":
+      lambda: state_chart("LIVE_AUTHORIZED_CONTRACTS"),
+    "authorizations_chart": lambda: submit_table(
+      'EIP7702_OVERVIEW_ACTIVITY_METRIC',
+      ['DATE', *chain_columns, 'NUM_AUTHORIZATIONS'],
+      TIMEFRAME=timeframe, **chain_filter),
+    "set_code_chart": lambda: submit_table(
+      'EIP7702_OVERVIEW_ACTIVITY_METRIC',
+      ['DATE', *chain_columns, 'NUM_SET_CODE_TXNS'],
+      TIMEFRAME=timeframe, **chain_filter),
+    "active_smart_wallets_chart": lambda: submit_table(
+      'EIP7702_OVERVIEW_ACTIVE_WALLETS_METRIC',
+      ['DATE', *chain_columns, 'ACTIVE_ACCOUNTS'],
+      TIMEFRAME=timeframe, **chain_filter),
+    "smart_wallet_actions": lambda: submit_table(
+      'EIP7702_OVERVIEW_ACTIONS_METRIC',
+      ['DATE', *chain_columns, 'NUM_ACTIONS'],
+      TIMEFRAME=timeframe, **chain_filter),
+    "smart_wallet_actions_type": lambda: submit_table(
+      'EIP7702_OVERVIEW_ACTIONS_TYPE_METRIC',
+      ['DATE', 'TYPE', 'NUM_ACTIONS'],
+      TIMEFRAME=timeframe, CHAIN=chain),
+  })
 
 @app.route('/eip7702-authorized-contracts')
-@cache.memoize(make_name=make_cache_key)
+@cached_view
 def eip7702_authorized_contracts():
   chain = request.args.get('chain', 'all')
 
-  leaderboard = execute_sql('''
-  SELECT
-  AUTHORIZED_CONTRACT,
-  NUM_WALLETS
-  FROM BUNDLEBEAR.DBT_KOFI.EIP7702_AUTH_CONTRACT_LEADERBOARD_METRIC
-  WHERE CHAIN = '{chain}'
-  ORDER BY 2 DESC
-  ''',chain=chain)
-
-  live_smart_wallets_chart = execute_sql('''
-  SELECT
-  DATE,
-  AUTHORIZED_CONTRACT,
-  NUM_WALLETS
-  FROM BUNDLEBEAR.DBT_KOFI.EIP7702_AUTH_CONTRACT_LIVE_WALLETS_METRIC
-  WHERE CHAIN = '{chain}'
-  ORDER BY 1     
-  ''',chain=chain)
-
-
-  response_data = {
-    "leaderboard": leaderboard,
-    "live_smart_wallets_chart": live_smart_wallets_chart
-  }
-
-  return jsonify(response_data)
+  return respond_sections({
+    **table_leaderboard(
+      'EIP7702_AUTH_CONTRACT_LEADERBOARD_METRIC',
+      ['AUTHORIZED_CONTRACT', 'NUM_WALLETS'],
+      'NUM_WALLETS', 'AUTHORIZED_CONTRACT', CHAIN=chain),
+    "live_smart_wallets_chart": lambda: submit_table(
+      'EIP7702_AUTH_CONTRACT_LIVE_WALLETS_METRIC',
+      ['DATE', 'AUTHORIZED_CONTRACT', 'NUM_WALLETS'],
+      CHAIN=chain),
+  })
 
 @app.route('/eip7702-apps')
-@cache.memoize(make_name=make_cache_key)
+@cached_view
 def eip7702_apps():
   chain = request.args.get('chain', 'all')
   timeframe = request.args.get('timeframe', 'week')
 
-  usage_chart = execute_sql('''
-  SELECT
-  DATE,
-  PROJECT,
-  NUM_UNIQUE_SENDERS
-  FROM BUNDLEBEAR.DBT_KOFI.EIP7702_APPS_USAGE_METRIC         
-  WHERE TIMEFRAME = '{time}'  
-  AND CHAIN = '{chain}'  
-  ORDER BY 1                                                                                        
-  ''', time=timeframe, chain=chain)
-
-  noncrime_usage_chart = execute_sql('''
-  SELECT
-  DATE,
-  PROJECT,
-  NUM_UNIQUE_SENDERS
-  FROM BUNDLEBEAR.DBT_KOFI.EIP7702_APPS_NONCRIME_USAGE_METRIC         
-  WHERE TIMEFRAME = '{time}'  
-  AND CHAIN = '{chain}'  
-  ORDER BY 1                                                                                     
-  ''', time=timeframe, chain=chain)
-
-  response_data = {
-    "usage_chart": usage_chart,
-    "noncrime_usage_chart": noncrime_usage_chart
-  }
-  
-  return jsonify(response_data)
+  return respond_sections({
+    "usage_chart": lambda: submit_table(
+      'EIP7702_APPS_USAGE_METRIC',
+      ['DATE', 'PROJECT', 'NUM_UNIQUE_SENDERS'],
+      TIMEFRAME=timeframe, CHAIN=chain),
+    "noncrime_usage_chart": lambda: submit_table(
+      'EIP7702_APPS_NONCRIME_USAGE_METRIC',
+      ['DATE', 'PROJECT', 'NUM_UNIQUE_SENDERS'],
+      TIMEFRAME=timeframe, CHAIN=chain),
+  })
     
 @app.route('/erc4337-activation')
-@cache.memoize(make_name=make_cache_key)
+@cached_view
 def erc4337_activation():
   chain = request.args.get('chain', 'all')
   timeframe = request.args.get('timeframe', 'week')
 
-  new_users_provider_chart = execute_sql('''
-  SELECT
-  DATE,
-  PROVIDER,
-  NUM_ACCOUNTS
-  FROM BUNDLEBEAR.DBT_KOFI.erc4337_activation_new_accounts_metric         
-  WHERE TIMEFRAME = '{time}'  
-  AND CHAIN = '{chain}'  
-  ORDER BY 1                                                                                     
-  ''', time=timeframe, chain=chain)
-
   if chain == 'all':
-    new_users_chain_chart = execute_sql('''
-    SELECT
-    DATE,
-    CHAIN,
-    NUM_ACCOUNTS
-    FROM BUNDLEBEAR.DBT_KOFI.erc4337_activation_new_accounts_chain_metric         
-    WHERE TIMEFRAME = '{time}' 
-    ORDER BY 1                                                                                      
-    ''', time=timeframe)
+    chain_columns, chain_filter = ['CHAIN'], {}
   else:
-    new_users_chain_chart = execute_sql('''
-    SELECT
-    DATE,
-    NUM_ACCOUNTS
-    FROM BUNDLEBEAR.DBT_KOFI.erc4337_activation_new_accounts_chain_metric         
-    WHERE TIMEFRAME = '{time}'                                                                                           
-    AND CHAIN = '{chain}'     
-    ORDER BY 1                                                                                    
-    ''', time=timeframe, chain=chain)
-
-  response_data = {
-    "new_users_provider_chart": new_users_provider_chart,
-    "new_users_chain_chart": new_users_chain_chart
-  }
-  
-  return jsonify(response_data)
+    chain_columns, chain_filter = [], {'CHAIN': chain}
+
+  return respond_sections({
+    "new_users_provider_chart": lambda: submit_table(
+      'ERC4337_ACTIVATION_NEW_ACCOUNTS_METRIC',
+      ['DATE', 'PROVIDER', 'NUM_ACCOUNTS'],
+      TIMEFRAME=timeframe, CHAIN=chain),
+    "new_users_chain_chart": lambda: submit_table(
+      'ERC4337_ACTIVATION_NEW_ACCOUNTS_CHAIN_METRIC',
+      ['DATE', *chain_columns, 'NUM_ACCOUNTS'],
+      TIMEFRAME=timeframe, **chain_filter),
+  })
 
 @app.route('/eip7702-x-erc4337')
-@cache.memoize(make_name=make_cache_key)
+@cached_view
 def eip7702_x_erc4337():
   chain = request.args.get('chain', 'all')
   timeframe = request.args.get('timeframe', 'week')
 
-  eip7702_x_erc4337_userops = execute_sql('''
-  WITH ranked AS (
-    SELECT
-      DATE,
-      AUTHORIZED_CONTRACT,
-      NUM_USEROPS,
-      ROW_NUMBER() OVER (PARTITION BY DATE ORDER BY NUM_USEROPS DESC) AS rn
-    FROM BUNDLEBEAR.DBT_KOFI.eip7702_4337_overlap_userops_metric
-    WHERE TIMEFRAME = '{time}'
-    AND CHAIN = '{chain}'
-  )
-  SELECT
-    DATE,
-    CASE WHEN rn <= 5 THEN AUTHORIZED_CONTRACT ELSE 'other' END AS AUTHORIZED_CONTRACT,
-    SUM(NUM_USEROPS) AS NUM_USEROPS
-  FROM ranked
-  GROUP BY 1,2
-  ORDER BY 1
-  ''', time=timeframe, chain=chain)
-
-  eip7702_x_erc4337_accounts = execute_sql('''
-  WITH ranked AS (
-    SELECT
-      DATE,
-      AUTHORIZED_CONTRACT,
-      NUM_ACCOUNTS,
-      ROW_NUMBER() OVER (PARTITION BY DATE ORDER BY NUM_ACCOUNTS DESC) AS rn
-    FROM BUNDLEBEAR.DBT_KOFI.eip7702_4337_overlap_accounts_metric
-    WHERE TIMEFRAME = '{time}'
-    AND CHAIN = '{chain}'
-  )
-  SELECT
-    DATE,
-    CASE WHEN rn <= 5 THEN AUTHORIZED_CONTRACT ELSE 'other' END AS AUTHORIZED_CONTRACT,
-    SUM(NUM_ACCOUNTS) AS NUM_ACCOUNTS
-  FROM ranked
-  GROUP BY 1,2
-  ORDER BY 1
-  ''', time=timeframe, chain=chain)
-
-  response_data = {
-    "eip7702_x_erc4337_userops": eip7702_x_erc4337_userops,
-    "eip7702_x_erc4337_accounts": eip7702_x_erc4337_accounts
-  }
-  
-  return jsonify(response_data)
+  # Top 5 contracts per date plus 'other' unless ?top= says otherwise.
+  return respond_sections({
+    "eip7702_x_erc4337_userops": bucketed(lambda: submit_table(
+      'EIP7702_4337_OVERLAP_USEROPS_METRIC',
+      ['DATE', 'AUTHORIZED_CONTRACT', 'NUM_USEROPS'],
+      TIMEFRAME=timeframe, CHAIN=chain), 5, 'date'),
+    "eip7702_x_erc4337_accounts": bucketed(lambda: submit_table(
+      'EIP7702_4337_OVERLAP_ACCOUNTS_METRIC',
+      ['DATE', 'AUTHORIZED_CONTRACT', 'NUM_ACCOUNTS'],
+      TIMEFRAME=timeframe, CHAIN=chain), 5, 'date'),
+  })
     
+
+def render_page(path, endpoint, query_string, headers):
+  # Runs the page's cached view as if it had been requested on its own, so
+  # the entry it computes is the one the page's own URL is served from.
+  with app.test_request_context(path, query_string=query_string,
+                                headers=headers):
+    metrics.route.set(path)
+    response = app.make_response(app.view_functions[endpoint]())
+    if response.status_code != 200:
+      abort(response)
+    return (response.get_data(), response.get_etag()[0],
+            int(response.last_modified.timestamp()),
+            time.time() + (response.cache_control.max_age or 0))
+
+
+@app.route('/dashboard')
+def dashboard():
+  """Several pages in one response: /dashboard?pages=overview,bundler&...
+
+  Every other param is passed on to each page. Cached pages are read with
+  one MGET, the rest are rendered concurrently and cached as usual. The
+  ETag is derived from the pages' ETags, so a conditional request is
+  answered from their meta records alone, and the response stays fresh only
+  as long as its stalest page.
+  """
+  names = list(dict.fromkeys(
+    name for name in request.args.get('pages', '').split(',') if name))
+  if not names:
+    abort(400, description="pages is required, e.g. pages=overview,bundler")
+  urls = app.url_map.bind('')
+  pages = {}
+  for name in names:
+    path = f"/{name}"
+    if path not in ROUTE_PARAMS:
+      abort(400, description=f"Unknown page: {name}")
+    endpoint = urls.match(path)[0]
+    if (endpoint in PROTECTED_ENDPOINTS
+        and request.headers.get('X-API-Password') != API_PASSWORD):
+      abort(401, description="Unauthorized: Invalid or missing API password")
+    pages[name] = (path, endpoint,
+                   build_cache_key(path, canonical_params(path, request.args)))
+
+  # (body, etag, last_modified, fresh_until) per page; the body is None
+  # until loaded.
+  found = {}
+  if not is_cache_refresh():
+    entries = response_cache.get_many([key for _, _, key in pages.values()],
+                                      meta=True)
+    for name, (_, _, key) in pages.items():
+      if key in entries:
+        found[name] = page_summary(entries[key])
+    if len(found) == len(pages):
+      meta = dashboard_meta(pages, found)
+      if response_cache.not_modified(meta):
+        return response_cache.respond(meta)
+      entry = response_cache.local.get(dashboard_key(meta))
+      if entry is not None:
+        return response_cache.respond(entry)
+    unloaded = [name for name, page in found.items() if page[0] is None]
+    loaded = response_cache.get_bodies([pages[name][2] for name in unloaded])
+    for name in unloaded:
+      entry = loaded.get(pages[name][2])
+      if entry is None:
+        del found[name]
+      else:
+        found[name] = page_summary(entry)
+
+  missing = [name for name in pages if name not in found]
+  if missing:
+    query_string = urlencode([(name, value)
+                              for name, value in request.args.items(multi=True)
+                              if name != 'pages'])
+    headers = {name: request.headers[name]
+               for name in ('X-API-Password', 'X-Cache-Refresh')
+               if name in request.headers}
+    token = shared_queries.set((threading.RLock(), {}))
+    try:
+      with ThreadPoolExecutor(max_workers=len(missing),
+                              thread_name_prefix='dashboard') as executor:
+        futures = {
+          name: executor.submit(contextvars.copy_context().run, render_page,
+                                pages[name][0], pages[name][1], query_string,
+                                headers)
+          for name in missing
+        }
+        found.update({name: future.result()
+                      for name, future in futures.items()})
+    finally:
+      shared_queries.reset(token)
+    # Otherwise X-Cache reports the last tier looked up: redis if any page
+    # came from Redis, local if all were in worker memory.
+    g.cache_result = 'miss'
+
+  # Each page is already JSON, so they are spliced in rather than re-encoded.
+  body = b'{' + b','.join(json.dumps(name).encode() + b':' + found[name][0]
+                          for name in pages) + b'}'
+  meta = dashboard_meta(pages, found)
+  # Only the encoding this client gets is compressed, and the result is kept
+  # in worker memory under the pages' ETags.
+  entry = make_entry(body, meta['etags']['identity'], meta['mimetype'],
+                     meta['last_modified'], meta['fresh_until'],
+                     encodings=[response_cache.best_encoding()])
+  response_cache.local.set(dashboard_key(meta), entry,
+                           min(time.time() + response_cache.local_ttl,
+                               meta['fresh_until']))
+  return response_cache.respond(entry)
+
+
+def dashboard_key(meta):
+  encoding = response_cache.best_encoding()
+  return f"dashboard:{meta['etags']['identity']}:{encoding}"
+
+
+def page_summary(entry):
+  return (entry['body']['identity'] if 'body' in entry else None,
+          entry['etags']['identity'], entry['last_modified'],
+          entry['fresh_until'])
+
+
+def dashboard_meta(pages, found):
+  digest = hashlib.sha256(','.join(
+    f"{name}:{found[name][1]}" for name in pages).encode()).hexdigest()[:32]
+  return make_meta(
+    digest, 'application/json',
+    max(last_modified for _, _, last_modified, _ in found.values()),
+    min(fresh_until for _, _, _, fresh_until in found.values()))
+
+
+# Table each route's valid chain (and timeframe) values are read from when
+# the warmer enumerates the parameter space.
+ROUTE_PARAM_SOURCES = {
+  '/overview': 'ERC4337_OVERVIEW_ACCOUNTS_BY_CATEGORY_METRIC',
+  '/bundler': 'ERC4337_BUNDLER_USEROPS_METRIC',
+  '/paymaster': 'ERC4337_PAYMASTER_USEROPS_METRIC',
+  '/account_deployer': 'ERC4337_BUNDLER_USEROPS_METRIC',
+  '/apps': 'ERC4337_APPS_USAGE_METRIC',
+  '/eip7702-overview': 'EIP7702_OVERVIEW_ACTIONS_TYPE_METRIC',
+  '/eip7702-authorized-contracts': 'EIP7702_AUTH_CONTRACT_LEADERBOARD_METRIC',
+  '/eip7702-apps': 'EIP7702_APPS_USAGE_METRIC',
+  '/erc4337-activation': 'ERC4337_ACTIVATION_NEW_ACCOUNTS_METRIC',
+  '/eip7702-x-erc4337': 'EIP7702_4337_OVERLAP_USEROPS_METRIC',
+}
+
+
+def route_param_values(path):
+  # The (chain, timeframe, ...) combinations a route has data for.
+  table = table_cache.get(ROUTE_PARAM_SOURCES[path])
+  return table.distinct(name.upper() for name in ROUTE_PARAMS[path])
+
+
+def discover_param_space(paths):
+  space = {}
+  for path in paths:
+    names = list(ROUTE_PARAMS[path])
+    space[path] = [dict(zip(names, combination))
+                   for combination in sorted(route_param_values(path))]
+  return space
+
+
+def warm_entry(url):
+  start = time.perf_counter()
+  response = app.test_client().get(url, headers={
+    'X-API-Password': API_PASSWORD,
+    'X-Cache-Refresh': '1'
+  })
+  return url, response.status_code, time.perf_counter() - start
+
+
+def warm_urls(urls, concurrency=WARM_CONCURRENCY, log=print):
+  results = []
+  with ThreadPoolExecutor(max_workers=concurrency,
+                          thread_name_prefix='warmer') as executor:
+    futures = [executor.submit(warm_entry, url) for url in urls]
+    for future in as_completed(futures):
+      url, status, elapsed = future.result()
+      results.append((url, status, elapsed))
+      log(f"{status} {elapsed:8.2f}s  {url}")
+  return results
+
+
+def warm_cache(paths=None, concurrency=WARM_CONCURRENCY, log=print):
+  space = discover_param_space(paths or list(ROUTE_PARAMS))
+  urls = [
+    f"{path}?{urlencode(sorted(params.items()))}"
+    for path, entries in space.items() for params in entries
+  ]
+  return warm_urls(urls, concurrency=concurrency, log=log)
+
+
+@app.cli.command('warm-cache')
+@click.option('--route', 'routes', multiple=True,
+              type=click.Choice(list(ROUTE_PARAMS)),
+              help='Only warm these routes (repeatable). Defaults to all.')
+@click.option('--concurrency', default=WARM_CONCURRENCY, show_default=True,
+              help='Number of entries warmed at the same time.')
+@click.option('--every', type=int, default=None,
+              help='Keep running and re-warm every N seconds.')
+def warm_cache_command(routes, concurrency, every):
+  """Recompute and cache every route x chain x timeframe combination.
+
+  Run it on a schedule shorter than CACHE_DEFAULT_TIMEOUT with
+  `flask --app main warm-cache`, or as a long-lived process with --every.
+  """
+  while True:
+    start = time.perf_counter()
+    results = warm_cache(routes or None, concurrency=concurrency)
+    failed = [url for url, status, _ in results if status != 200]
+    click.echo(f"Warmed {len(results) - len(failed)}/{len(results)} entries "
+               f"in {time.perf_counter() - start:.2f}s")
+    for url in failed:
+      click.echo(f"  failed: {url}", err=True)
+    if every is None:
+      return
+    time.sleep(every)
+
+
+# Tables (fnmatch patterns) each route reads, used to work out which cached
+# routes a dbt refresh has made stale.
+ROUTE_TABLES = {
+  '/overview': [
+    'ERC4337_OVERVIEW_SUMMARY_STATS_METRIC',
+    'ERC4337_OVERVIEW_ACCOUNTS_BY_CATEGORY_METRIC',
+    'ERC4337_OVERVIEW_ACTIVE_ACCOUNTS_METRIC',
+    'ERC4337_OVERVIEW_USEROPS_METRIC',
+    'ERC4337_OVERVIEW_PAYMASTER_SPEND_METRIC',
+    'ERC4337_OVERVIEW_BUNDLER_REVENUE_METRIC',
+  ],
+  '/bundler': [
+    'ERC4337_BUNDLER_LEADERBOARD_METRIC',
+    'ERC4337_BUNDLER_USEROPS_METRIC',
+    'ERC4337_BUNDLER_REVENUE_METRIC',
+    'ERC4337_BUNDLER_MULTIOP_METRIC',
+    'ERC4337_BUNDLER_ACCOUNTS_METRIC',
+    'ERC4337_BUNDLER_FRONTRUN_METRIC',
+    'ERC4337_BUNDLER_FRONTRUN_PCT_METRIC',
+  ],
+  '/paymaster': [
+    'ERC4337_PAYMASTER_LEADERBOARD_METRIC',
+    'ERC4337_PAYMASTER_USEROPS_METRIC',
+    'ERC4337_PAYMASTER_SPEND_METRIC',
+    'ERC4337_PAYMASTER_ACCOUNTS_METRIC',
+    'ERC4337_PAYMASTER_SPEND_TYPE_METRIC',
+  ],
+  '/account_deployer': [
+    'ERC4337_*_ACCOUNT_DEPLOYMENTS',
+    'ERC4337_*_USEROPS',
+    'ERC4337_LABELS_FACTORIES',
+  ],
+  '/apps': [
+    'ERC4337_APPS_USAGE_METRIC',
+    'ERC4337_APPS_OPS_METRIC',
+    'ERC4337_APPS_LEADERBOARD_METRIC',
+  ],
+  '/eip7702-overview': [
+    'EIP7702_METRICS_TOTAL_SUMMARY',
+    'EIP7702_OVERVIEW_ACTIONS_TYPE_METRIC',
+    'EIP7702_OVERVIEW_ACTIVITY_METRIC',
+    'EIP7702_METRICS_DAILY_AUTHORITY_STATE',
+    'EIP7702_OVERVIEW_ACTIVE_WALLETS_METRIC',
+    'EIP7702_OVERVIEW_ACTIONS_METRIC',
+  ],
+  '/eip7702-authorized-contracts': [
+    'EIP7702_AUTH_CONTRACT_LEADERBOARD_METRIC',
+    'EIP7702_AUTH_CONTRACT_LIVE_WALLETS_METRIC',
+  ],
+  '/eip7702-apps': [
+    'EIP7702_APPS_USAGE_METRIC',
+    'EIP7702_APPS_NONCRIME_USAGE_METRIC',
+  ],
+  '/erc4337-activation': [
+    'ERC4337_ACTIVATION_NEW_ACCOUNTS_METRIC',
+    'ERC4337_ACTIVATION_NEW_ACCOUNTS_CHAIN_METRIC',
+  ],
+  '/eip7702-x-erc4337': [
+    'EIP7702_4337_OVERLAP_USEROPS_METRIC',
+    'EIP7702_4337_OVERLAP_ACCOUNTS_METRIC',
+  ],
+}
+
+def routes_reading(tables):
+  return sorted(
+    path for path, patterns in ROUTE_TABLES.items()
+    if any(fnmatch.fnmatchcase(table, pattern)
+           for table in tables for pattern in patterns))
+
+
+def fetch_table_versions():
+  rows = execute_sql('''
+  SELECT TABLE_NAME, LAST_ALTERED
+  FROM BUNDLEBEAR.INFORMATION_SCHEMA.TABLES
+  WHERE TABLE_SCHEMA = 'DBT_KOFI'
+  AND (STARTSWITH(TABLE_NAME, 'ERC4337_') OR STARTSWITH(TABLE_NAME, 'EIP7702_'))
+  ''')
+  return {row["TABLE_NAME"]: row["LAST_ALTERED"].isoformat() for row in rows}
+
+
+def refresh_changed_routes(rewarm=True, concurrency=WARM_CONCURRENCY,
+                           log=print):
+  current = fetch_table_versions()
+  known = {
+    table.decode(): version.decode()
+    for table, version in redis_client.hgetall(TABLE_VERSIONS_KEY).items()
+  }
+  changed = sorted(table for table, version in current.items()
+                   if known.get(table) != version)
+  # Routes are queued before the new versions are recorded (which is what
+  # makes the table cache fetch the changed tables again), so a run that is
+  # interrupted part way still refreshes them next time.
+  if changed:
+    redis_client.sadd(PENDING_ROUTES_KEY, *routes_reading(changed))
+    redis_client.hset(TABLE_VERSIONS_KEY, mapping=current)
+  return changed, refresh_pending_routes(rewarm, concurrency, log)
+
+
+def refresh_pending_routes(rewarm=True, concurrency=WARM_CONCURRENCY,
+                           log=print):
+  paths = sorted(path.decode()
+                 for path in redis_client.smembers(PENDING_ROUTES_KEY))
+  for path in paths:
+    response_cache.drop_parts(path)
+    keys = response_cache.keys_for(path)
+    if rewarm:
+      results = warm_urls([key.split(':', 1)[1] for key in keys],
+                          concurrency=concurrency, log=log)
+      failed = {url for url, status, _ in results if status != 200}
+      refreshed = [key for key in keys if key.split(':', 1)[1] not in failed]
+      response_cache.invalidate(refreshed, local_only=True)
+      keys = [key for key in keys if key not in refreshed]
+    if keys:
+      response_cache.invalidate(keys)
+      redis_client.srem(index_key(path), *keys)
+    redis_client.srem(PENDING_ROUTES_KEY, path)
+  return paths
+
+
+@app.cli.command('refresh-changed')
+@click.option('--rewarm/--no-rewarm', default=True, show_default=True,
+              help='Recompute affected entries instead of only dropping them.')
+@click.option('--concurrency', default=WARM_CONCURRENCY, show_default=True,
+              help='Number of entries warmed at the same time.')
+@click.option('--every', type=int, default=None,
+              help='Keep running and check again every N seconds.')
+def refresh_changed_command(rewarm, concurrency, every):
+  """Refresh cached routes whose source tables changed since the last run.
+
+  Compares LAST_ALTERED of the ERC4337_* / EIP7702_* tables with the
+  versions seen on the previous run. Schedule it after dbt runs, or keep it
+  running with --every; with CACHE_INVALIDATION=tables it is the only thing
+  that replaces cached entries.
+  """
+  while True:
+    changed, paths = refresh_changed_routes(rewarm=rewarm,
+                                            concurrency=concurrency)
+    click.echo(f"{len(changed)} tables changed, refreshed "
+               f"{', '.join(paths) or 'no routes'}")
+    if every is None:
+      return
+    time.sleep(every)
+
+
+@app.cli.command('refresh-rollups')
+@click.option('--rewarm/--no-rewarm', default=True, show_default=True,
+              help='Recompute cached /account_deployer entries afterwards.')
+@click.option('--concurrency', default=WARM_CONCURRENCY, show_default=True,
+              help='Number of entries warmed at the same time.')
+@click.option('--every', type=int, default=None,
+              help='Keep running and refresh again every N seconds.')
+def refresh_rollups_command(rewarm, concurrency, every):
+  """Update the local accounts rollup behind /account_deployer.
+
+  Only user ops in the buckets from the last BLOCK_TIME seen onwards are
+  aggregated; the first run builds the full 24 months. The rollup lives in
+  ACCOUNTS_ROLLUP_PATH on this host, so run this next to the web workers.
+  """
+  while True:
+    counts = {period: accounts_rollup.refresh(period)
+              for period in accounts_rollup.periods}
+    if any(counts.values()):
+      redis_client.sadd(PENDING_ROUTES_KEY, '/account_deployer')
+      refresh_pending_routes(rewarm=rewarm, concurrency=concurrency)
+    click.echo(', '.join(f"{period}: {count} rows"
+                         for period, count in counts.items()))
+    if every is None:
+      return
+    time.sleep(every)
+
+
 if __name__ == '__main__':
   app.run(host='0.0.0.0', port=81)
 
@@ -0,0 +1,82 @@
+import contextvars
+import logging
+import os
+import re
+
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry,
+                               Counter, Histogram, generate_latest, multiprocess)
+
+logger = logging.getLogger('bundlebear.queries')
+
+# The route a query runs for. Set per request and carried into the query
+# threads with contextvars.copy_context().
+route = contextvars.ContextVar('route', default='none')
+
+QUERY_SECONDS = Histogram(
+  'snowflake_query_seconds', 'Wall time of Snowflake queries, incl. fetching',
+  ['route', 'dataset'],
+  buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 60, 120, float('inf')))
+CONNECT_SECONDS = Histogram(
+  'snowflake_connect_seconds', 'Time spent getting a pooled connection',
+  ['route', 'dataset'],
+  buckets=(0.001, 0.01, 0.1, 0.5, 1, 2.5, 5, 10, 30, float('inf')))
+QUERY_ROWS = Counter('snowflake_query_rows', 'Rows returned by Snowflake',
+                     ['route', 'dataset'])
+QUERY_BYTES = Counter('snowflake_query_bytes',
+                      'Uncompressed result bytes returned by Snowflake',
+                      ['route', 'dataset'])
+QUERY_ERRORS = Counter('snowflake_query_errors', 'Failed Snowflake queries',
+                       ['route', 'dataset'])
+CACHE_LOOKUPS = Counter('response_cache_lookups',
+                        'Response cache lookups by tier and outcome',
+                        ['route', 'tier', 'result'])
+
+
+def dataset_of(sql):
+  """Labels a query with the first DBT_KOFI table it reads."""
+  match = re.search(r'DBT_KOFI\.(\w+)', sql) or re.search(r'FROM\s+([\w.]+)',
+                                                          sql)
+  return match.group(1).upper() if match else 'unknown'
+
+
+def result_bytes(cursor):
+  try:
+    return sum(batch.uncompressed_size or 0
+               for batch in cursor.get_result_batches() or [])
+  except Exception:
+    return 0
+
+
+def observe_query(dataset, wall, rows, connect=None, size=0, query_id=None):
+  labels = (route.get(), dataset)
+  QUERY_SECONDS.labels(*labels).observe(wall)
+  if connect is not None:
+    CONNECT_SECONDS.labels(*labels).observe(connect)
+  QUERY_ROWS.labels(*labels).inc(rows)
+  QUERY_BYTES.labels(*labels).inc(size)
+  logger.info('query route=%s dataset=%s wall_ms=%.1f connect_ms=%s rows=%d '
+              'bytes=%d query_id=%s', *labels, wall * 1000,
+              '-' if connect is None else f"{connect * 1000:.1f}", rows, size,
+              query_id)
+
+
+def observe_error(dataset):
+  QUERY_ERRORS.labels(route.get(), dataset).inc()
+
+
+def observe_cache_lookup(path, tier, hit):
+  CACHE_LOOKUPS.labels(path, tier, 'hit' if hit else 'miss').inc()
+
+
+def render():
+  """Returns the metrics page and its content type.
+
+  Under gunicorn with several workers, set PROMETHEUS_MULTIPROC_DIR to an
+  empty directory so every worker's samples are aggregated; otherwise each
+  scrape only sees the worker that answered it.
+  """
+  registry = REGISTRY
+  if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+  return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,533 @@
+import gzip
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import request
+from redis.exceptions import LockError
+
+from timing import phase
+
+try:
+  import brotli
+except ImportError:
+  brotli = None
+
+DATA_VERSION_KEY = 'cache:data-version'
+# Content-Encodings served besides identity, in order of preference.
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+INVALIDATE_CHANNEL = 'cache:invalidate'
+
+
+def index_key(path):
+  return f"cache:index:{path}"
+
+
+def parts_key(path):
+  return f"cache:parts-expiry:{path}"
+
+
+def encode_body(data, encodings=ENCODINGS):
+  """Returns ``data`` as is and in each of ``encodings``."""
+  body = {'identity': data}
+  if 'gzip' in encodings:
+    body['gzip'] = gzip.compress(data, compresslevel=6)
+  if 'br' in encodings and brotli is not None:
+    body['br'] = brotli.compress(data, quality=5)
+  return body
+
+
+def make_meta(digest, mimetype, last_modified, fresh_until,
+              encodings=('identity',) + ENCODINGS):
+  """Returns an entry without a body, enough to answer with 304."""
+  return {
+    'etags': {
+      encoding: digest if encoding == 'identity' else f"{digest}-{encoding}"
+      for encoding in encodings
+    },
+    'last_modified': last_modified,
+    'mimetype': mimetype,
+    'fresh_until': fresh_until,
+  }
+
+
+def make_entry(data, digest, mimetype, last_modified, fresh_until,
+               encodings=ENCODINGS):
+  """Returns a servable entry for ``data`` with an ETag per encoding."""
+  body = encode_body(data, encodings)
+  return dict(make_meta(digest, mimetype, last_modified, fresh_until, body),
+              body=body)
+
+
+class LocalCache:
+  """Thread-safe in-process LRU bounded by total size in bytes."""
+
+  def __init__(self, max_bytes, sizeof):
+    self.max_bytes = max_bytes
+    self.sizeof = sizeof
+    self._entries = OrderedDict()
+    self._bytes = 0
+    self._lock = threading.Lock()
+
+  def get(self, key):
+    with self._lock:
+      item = self._entries.get(key)
+      if item is None:
+        return None
+      expires, _, value = item
+      if expires <= time.time():
+        self._pop(key)
+        return None
+      self._entries.move_to_end(key)
+      return value
+
+  def set(self, key, value, expires):
+    size = self.sizeof(value)
+    if size > self.max_bytes:
+      return
+    with self._lock:
+      self._pop(key)
+      self._entries[key] = (expires, size, value)
+      self._bytes += size
+      while self._bytes > self.max_bytes:
+        self._pop(next(iter(self._entries)))
+
+  def delete(self, keys):
+    with self._lock:
+      for key in keys:
+        self._pop(key)
+
+  def clear(self):
+    with self._lock:
+      self._entries.clear()
+      self._bytes = 0
+
+  def _pop(self, key):
+    item = self._entries.pop(key, None)
+    if item is not None:
+      self._bytes -= item[1]
+
+  def info(self):
+    with self._lock:
+      return {'entries': len(self._entries), 'bytes': self._bytes,
+              'max_bytes': self.max_bytes}
+
+
+class ResponseCache:
+  """Caches view responses in worker memory and Redis with single-flight fills.
+
+  Each entry is stored with the time it stops being fresh and is kept in
+  Redis for a further ``stale_timeout`` seconds. When a key is missing, only
+  the worker holding the ``lock:<key>`` lease recomputes it; other workers
+  poll until the entry appears, or compute it themselves if the lease runs
+  out. An expired entry is served straight away while one worker refreshes
+  it in the background (stale-while-revalidate).
+
+  Fresh entries are also kept in a per-worker LRU for at most ``local_ttl``
+  seconds. Every entry is tagged with the data version it was built under;
+  ``invalidate`` bumps that version or drops single keys and announces it
+  over Redis pub/sub so every worker discards its local copies. The keys
+  stored for each route are indexed in ``cache:index:<path>`` so they can be
+  refreshed or dropped per route. With ``timeout=None`` entries never go
+  stale and are only replaced through ``invalidate`` or a forced update.
+
+  Entries hold the final JSON bytes together with their gzip and brotli
+  encodings, so a hit only picks the variant the client accepts and writes
+  it out without touching JSON or a compressor. ``on_lookup(path, tier,
+  hit)`` is called for every local and Redis lookup.
+
+  Views can also cache pieces of a response with ``get_parts`` and
+  ``set_parts``; those live in Redis only and follow the same data version.
+  A view built from older parts sets ``max_age`` on its response, which caps
+  how long the entry made from it stays fresh.
+
+  Requests for which ``is_variant()`` is true, such as one page of a
+  leaderboard, can take arbitrary values. Their entries are kept for at most
+  ``variant_timeout`` seconds and indexed with the route's parts rather than
+  in ``cache:index:<path>``, so a refresh drops them instead of recomputing
+  each one. That index is a sorted set scored by expiry, trimmed of expired
+  keys on every write.
+
+  Responses carry a strong ETag per encoding, Last-Modified and a
+  Cache-Control max-age that runs out when the entry does. Conditional
+  requests are answered with 304 from a small ``meta:<key>`` record without
+  loading the body.
+  """
+
+  def __init__(self, app, cache, redis_client, make_key, forced_update=None,
+               on_lookup=None, timeout=57600, stale_timeout=86400, lease=150,
+               poll_interval=0.1, local_max_bytes=64 * 1024 * 1024,
+               local_ttl=300, max_age=3600, is_variant=None,
+               variant_timeout=3600):
+    self.app = app
+    self.cache = cache
+    self.redis = redis_client
+    self.make_key = make_key
+    self.forced_update = forced_update
+    self.on_lookup = on_lookup
+    self.timeout = timeout
+    self.stale_timeout = stale_timeout
+    self.is_variant = is_variant
+    self.variant_timeout = (variant_timeout if timeout is None
+                            else min(variant_timeout, timeout))
+    self.lease = lease
+    self.poll_interval = poll_interval
+    self.local_ttl = local_ttl if timeout is None else min(local_ttl, timeout)
+    self.max_age = max_age
+    self.local = LocalCache(
+      local_max_bytes,
+      lambda entry: sum(len(data) for data in entry['body'].values()))
+    self.stats = {
+      'local': {'hits': 0, 'misses': 0},
+      'redis': {'hits': 0, 'misses': 0},
+    }
+    self._stats_lock = threading.Lock()
+    self._pid = None
+    self._subscriber = None
+    self._subscribe_lock = threading.Lock()
+    self.version = 0
+
+  def view(self, f):
+    @wraps(f)
+    def decorated(*args, **kwargs):
+      self._ensure_subscribed()
+      key = self.make_key()
+      if self.forced_update is not None and self.forced_update():
+        return self._compute(key, f, args, kwargs)
+
+      entry = self.local.get(key)
+      self._count('local', entry is not None)
+      if entry is not None:
+        return self.respond(entry)
+
+      if self._is_conditional():
+        meta = self._get_shared(f"meta:{key}")
+        if (meta is not None and meta['fresh_until'] > time.time()
+            and self.not_modified(meta)):
+          return self.respond(meta)
+
+      entry = self._get_shared(key)
+      self._count('redis', entry is not None)
+      if entry is None:
+        return self._fill(key, f, args, kwargs)
+      if entry['fresh_until'] <= time.time():
+        self._revalidate(key, f, args, kwargs)
+      else:
+        self._store_local(key, entry)
+      return self.respond(entry)
+
+    return decorated
+
+  def get_many(self, keys, meta=False):
+    """Returns the fresh entries among ``keys`` by key.
+
+    Worker memory is checked first and the rest are read from Redis in one
+    MGET. Missing and stale keys are left out; serve those through the view.
+    With ``meta`` only the ``meta:`` records are read from Redis, so entries
+    without a 'body' have to be loaded with ``get_bodies``.
+    """
+    self._ensure_subscribed()
+    found = {}
+    for key in keys:
+      entry = self.local.get(key)
+      self._count('local', entry is not None)
+      if entry is not None:
+        found[key] = entry
+    missing = [key for key in keys if key not in found]
+    if not missing:
+      return found
+    with phase('redis'):
+      entries = self.cache.get_many(*(f"meta:{key}" if meta else key
+                                      for key in missing))
+    now = time.time()
+    for key, entry in zip(missing, entries):
+      fresh = (entry is not None and entry['version'] >= self.version
+               and entry['fresh_until'] > now)
+      self._count('redis', fresh)
+      if fresh:
+        if not meta:
+          self._store_local(key, entry)
+        found[key] = entry
+    return found
+
+  def get_bodies(self, keys):
+    """Loads the entries ``get_many(meta=True)`` found in Redis by key.
+
+    Entries replaced by an older version or gone since are left out.
+    """
+    if not keys:
+      return {}
+    with phase('redis'):
+      entries = self.cache.get_many(*keys)
+    found = {}
+    for key, entry in zip(keys, entries):
+      if entry is not None and entry['version'] >= self.version:
+        self._store_local(key, entry)
+        found[key] = entry
+    return found
+
+  def get_parts(self, keys):
+    """Returns ``(data, fresh_until)`` by key for the fresh parts stored with
+    ``set_parts`` among ``keys``."""
+    if not keys:
+      return {}
+    with phase('redis'):
+      entries = self.cache.get_many(*keys)
+    now = time.time()
+    return {key: (entry['data'], entry['fresh_until'])
+            for key, entry in zip(keys, entries)
+            if entry is not None and entry['version'] >= self.version
+            and entry.get('fresh_until', 0) > now}
+
+  def set_parts(self, parts, version, variant=False):
+    """Stores ``{key: data}`` built under data ``version`` for this route.
+
+    ``variant`` parts are kept for ``variant_timeout`` seconds at most.
+    """
+    if not parts:
+      return
+    if variant:
+      timeout = self.variant_timeout
+    else:
+      timeout = 0 if self.timeout is None else self.timeout
+    fresh_until = time.time() + timeout if timeout else math.inf
+    with phase('redis'):
+      self.cache.set_many(
+        {key: {'data': data, 'version': version, 'fresh_until': fresh_until}
+         for key, data in parts.items()},
+        timeout=timeout)
+      self._track_parts(parts, timeout)
+
+  def drop_parts(self, path):
+    """Drops the route's parts and variant entries everywhere."""
+    keys = [key.decode() for key in self.redis.zrange(parts_key(path), 0, -1)]
+    if keys:
+      self.invalidate(keys)
+      self.redis.zrem(parts_key(path), *keys)
+
+  def _track_parts(self, keys, timeout):
+    now = time.time()
+    expires = now + timeout if timeout else math.inf
+    pipe = self.redis.pipeline()
+    pipe.zadd(parts_key(request.path), {key: expires for key in keys})
+    pipe.zremrangebyscore(parts_key(request.path), '-inf', now)
+    pipe.execute()
+
+  def _is_conditional(self):
+    return bool(request.if_none_match or request.if_modified_since)
+
+  def not_modified(self, entry):
+    """Whether the request's validators match ``entry``."""
+    if request.if_none_match:
+      return any(request.if_none_match.contains(etag)
+                 for etag in entry['etags'].values())
+    if request.if_modified_since:
+      return entry['last_modified'] <= request.if_modified_since.timestamp()
+    return False
+
+  def best_encoding(self, encodings=ENCODINGS):
+    """Returns the one of ``encodings`` the client prefers, or identity."""
+    return request.accept_encodings.best_match(
+      [encoding for encoding in ENCODINGS if encoding in encodings],
+      default='identity')
+
+  def respond(self, entry):
+    """Serves ``entry`` in the best encoding the client accepts."""
+    encoding = self.best_encoding(entry['etags'])
+    if self.not_modified(entry):
+      response = self.app.response_class(status=304)
+    else:
+      response = self.app.response_class(entry['body'][encoding],
+                                         mimetype=entry['mimetype'],
+                                         direct_passthrough=True)
+      if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.set_etag(entry['etags'][encoding])
+    response.last_modified = entry['last_modified']
+    # Password-protected routes must not end up in a shared cache.
+    if 'X-API-Password' in request.headers:
+      response.cache_control.private = True
+    else:
+      response.cache_control.public = True
+    response.cache_control.max_age = int(
+      max(0, min(self.max_age, entry['fresh_until'] - time.time())))
+    return response
+
+  def _count(self, tier, hit):
+    with self._stats_lock:
+      self.stats[tier]['hits' if hit else 'misses'] += 1
+    if self.on_lookup is not None:
+      self.on_lookup(request.path, tier, hit)
+
+  def _get_shared(self, key):
+    with phase('redis'):
+      entry = self.cache.get(key)
+    if entry is None or entry['version'] < self.version:
+      return None
+    return entry
+
+  def _store_local(self, key, entry):
+    self.local.set(key, entry,
+                   min(time.time() + self.local_ttl, entry['fresh_until']))
+
+  def _lock(self, key):
+    return self.redis.lock(f"lock:{key}", timeout=self.lease,
+                           thread_local=False)
+
+  def _compute(self, key, f, args, kwargs):
+    version = self.version
+    with phase('view'):
+      response = self.app.make_response(f(*args, **kwargs))
+    if response.status_code != 200:
+      return response
+    data = response.get_data()
+    digest = hashlib.sha256(data).hexdigest()[:32]
+    now = time.time()
+    variant = self.is_variant is not None and self.is_variant()
+    if variant:
+      fresh_until, timeout = now + self.variant_timeout, self.variant_timeout
+    elif self.timeout is None:
+      fresh_until, timeout = math.inf, 0
+    else:
+      fresh_until = now + self.timeout
+      timeout = self.timeout + self.stale_timeout
+    if response.cache_control.max_age is not None:
+      # Built from parts cached earlier: fresh only as long as the oldest,
+      # then revalidated like any stale entry.
+      fresh_until = min(fresh_until, now + response.cache_control.max_age)
+    with phase('compress'):
+      entry = make_entry(data, digest, response.mimetype, int(now), fresh_until)
+    entry['version'] = version
+    meta = {name: value for name, value in entry.items() if name != 'body'}
+    with phase('redis'):
+      self.cache.set_many({key: entry, f"meta:{key}": meta}, timeout=timeout)
+      if variant:
+        self._track_parts([key], timeout)
+      else:
+        self.redis.sadd(index_key(request.path), key)
+    self._store_local(key, entry)
+    return self.respond(entry)
+
+  def _fill(self, key, f, args, kwargs):
+    lock = self._lock(key)
+    deadline = time.monotonic() + self.lease
+    while not lock.acquire(blocking=False):
+      if time.monotonic() >= deadline:
+        # The lease holder died or is too slow; stop waiting on it.
+        return self._compute(key, f, args, kwargs)
+      with phase('fill-wait'):
+        time.sleep(self.poll_interval)
+      # Poll the small meta record; the body is only loaded once it exists.
+      if self._get_shared(f"meta:{key}") is not None:
+        entry = self._get_shared(key)
+        if entry is not None:
+          return self.respond(entry)
+    try:
+      # Another worker may have filled the key between our miss and taking
+      # the lock.
+      entry = self._get_shared(key)
+      if entry is not None:
+        return self.respond(entry)
+      return self._compute(key, f, args, kwargs)
+    finally:
+      self._release(lock)
+
+  def _revalidate(self, key, f, args, kwargs):
+    lock = self._lock(key)
+    if not lock.acquire(blocking=False):
+      return
+    path, query_string = request.path, request.query_string.decode()
+
+    def refresh():
+      try:
+        with self.app.test_request_context(path, query_string=query_string):
+          self._compute(key, f, args, kwargs)
+      except Exception:
+        self.app.logger.exception(f"Background refresh of {key} failed")
+      finally:
+        self._release(lock)
+
+    threading.Thread(target=refresh, name='cache-refresh', daemon=True).start()
+
+  def _release(self, lock):
+    try:
+      lock.release()
+    except LockError:
+      # The lease expired while we were computing; nothing left to release.
+      pass
+
+  def invalidate(self, keys=None, local_only=False):
+    """Drops ``keys`` everywhere, or every entry when no keys are given.
+
+    With ``local_only`` the Redis entries are kept and only the workers'
+    in-process copies are discarded, e.g. after the keys were recomputed.
+    """
+    if keys is None:
+      message = {'version': self.redis.incr(DATA_VERSION_KEY)}
+    else:
+      keys = list(keys)
+      if keys and not local_only:
+        self.cache.delete_many(*keys, *(f"meta:{key}" for key in keys))
+      message = {'keys': keys}
+    self.redis.publish(INVALIDATE_CHANNEL, json.dumps(message))
+    self._on_invalidate(message)
+
+  def keys_for(self, path):
+    """Returns the keys stored for ``path``, pruning those that expired."""
+    keys = sorted(key.decode() for key in self.redis.smembers(index_key(path)))
+    if not keys:
+      return keys
+    metas = self.cache.get_many(*(f"meta:{key}" for key in keys))
+    expired = [key for key, meta in zip(keys, metas) if meta is None]
+    if expired:
+      self.redis.srem(index_key(path), *expired)
+    return [key for key, meta in zip(keys, metas) if meta is not None]
+
+  def _on_invalidate(self, message):
+    if 'version' in message:
+      self.version = max(self.version, message['version'])
+      self.local.clear()
+    else:
+      self.local.delete(message['keys'])
+
+  def _ensure_subscribed(self):
+    # Subscribe once per process; a subscriber inherited across a fork does
+    # not run in the child.
+    if self._pid == os.getpid():
+      return
+    with self._subscribe_lock:
+      if self._pid != os.getpid():
+        self._subscribe()
+
+  def _subscribe(self):
+    self.local.clear()
+    pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(**{
+      INVALIDATE_CHANNEL:
+      lambda message: self._on_invalidate(json.loads(message['data']))
+    })
+    # Read the version only after subscribing so a bump cannot slip between.
+    self.version = int(self.redis.get(DATA_VERSION_KEY) or 0)
+    self._subscriber = pubsub.run_in_thread(sleep_time=1, daemon=True,
+                                            exception_handler=self._on_error)
+    self._pid = os.getpid()
+
+  def _on_error(self, e, pubsub, thread):
+    # Invalidations may have been missed while disconnected, so forget local
+    # copies rather than risk serving them.
+    self.app.logger.warning(f"Cache invalidation subscriber error: {e}")
+    self.local.clear()
+    time.sleep(1)
+
+  def info(self):
+    with self._stats_lock:
+      stats = {tier: dict(counts) for tier, counts in self.stats.items()}
+    stats['local'].update(self.local.info())
+    stats['data_version'] = self.version
+    return stats
@@ -0,0 +1,41 @@
+import pyarrow as pa
+import pyarrow.compute as pc
+
+
+def _to_python(column):
+  # Decimals are served as JSON numbers: whole NUMBERs as ints, the rest as
+  # floats. The cast runs over the whole column before any Python objects
+  # are built.
+  if pa.types.is_decimal(column.type):
+    if column.type.scale == 0:
+      try:
+        column = pc.cast(column, pa.int64())
+      except pa.ArrowInvalid:
+        column = pc.cast(column, pa.float64(), safe=False)
+    else:
+      column = pc.cast(column, pa.float64(), safe=False)
+  return column.to_pylist()
+
+
+def fetch_columns(cursor):
+  """Returns a cursor's result as ``(columns, {column: values})``.
+
+  The result is read as Arrow record batches and converted a column at a
+  time, so no per-row dicts or Decimal objects are created. Dates and
+  timestamps come back as ``date``/``datetime`` values, as with DictCursor.
+  """
+  columns = [column.name for column in cursor.description]
+  batches = list(cursor.fetch_arrow_batches())
+  if not batches:
+    return columns, {column: [] for column in columns}
+  table = pa.concat_tables(batches)
+  return columns, {
+    column: _to_python(values) for column, values in zip(columns, table.columns)
+  }
+
+
+def fetch_rows(cursor):
+  """Returns a cursor's result as row dicts, like ``DictCursor.fetchall``."""
+  columns, data = fetch_columns(cursor)
+  return [dict(zip(columns, values))
+          for values in zip(*(data[column] for column in columns))]
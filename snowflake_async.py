@@ -0,0 +1,129 @@
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from snowflake.connector import DictCursor
+
+from snowflake_pool import is_session_expired
+
+
+class AsyncQueryRunner:
+  """Runs queries on the warehouse without holding a thread per query.
+
+  ``submit`` hands the query to Snowflake with ``execute_async`` and returns
+  a future straight away. A single poller thread per worker watches every
+  outstanding query ID, whichever request submitted it, and once a query
+  finishes its rows are fetched on a small thread pool so one large result
+  does not hold up the polling of the others. Cancelling a future before it
+  resolves aborts the query on the warehouse. ``fetch(cursor)`` reads the
+  rows of a finished query (``fetchall`` by default).
+  """
+
+  def __init__(self, pool, poll_interval=0.2, fetch_workers=4, fetch=None):
+    self._pool = pool
+    self.poll_interval = poll_interval
+    self.fetch_workers = fetch_workers
+    self._fetch_results = fetch or (lambda cursor: cursor.fetchall())
+    self._reset()
+
+  def _reset(self):
+    self._pid = os.getpid()
+    self._lock = threading.Lock()
+    self._pending = {}
+    self._poller = None
+    self._fetcher = ThreadPoolExecutor(max_workers=self.fetch_workers,
+                                       thread_name_prefix='snowflake-fetch')
+
+  def submit(self, sql):
+    if self._pid != os.getpid():
+      self._reset()
+    query_id = self._execute_async(sql)
+    future = Future()
+    future.query_id = query_id
+    with self._lock:
+      self._pending[query_id] = future
+      if self._poller is None:
+        self._poller = threading.Thread(target=self._poll,
+                                        name='snowflake-poller',
+                                        daemon=True)
+        self._poller.start()
+    return future
+
+  def _execute_async(self, sql):
+    for attempt in range(2):
+      try:
+        with self._pool.connection() as conn:
+          cursor = conn.cursor()
+          cursor.execute_async(sql)
+          return cursor.sfqid
+      except Exception as e:
+        if attempt == 0 and is_session_expired(e):
+          continue
+        raise
+
+  def _poll(self):
+    while True:
+      with self._lock:
+        if not self._pending:
+          self._poller = None
+          return
+        pending = list(self._pending.items())
+      try:
+        with self._pool.connection() as conn:
+          for query_id, future in pending:
+            self._check(conn, query_id, future)
+      except TimeoutError:
+        # Every pooled connection is busy, which passes; waiting for one
+        # already took the pool's timeout, so just try again.
+        continue
+      except Exception as e:
+        # Without a working connection none of the pending queries can be
+        # followed up, so fail them rather than spin.
+        with self._lock:
+          failed = [(query_id, future) for query_id, future in pending
+                    if self._pending.get(query_id) is future]
+        for query_id, future in failed:
+          self._resolve(query_id, future, error=e)
+      time.sleep(self.poll_interval)
+
+  def _check(self, conn, query_id, future):
+    if future.cancelled():
+      with self._lock:
+        self._pending.pop(query_id, None)
+      try:
+        conn.cursor().abort_query(query_id)
+      except Exception:
+        pass
+      return
+    try:
+      status = conn.get_query_status_throw_if_error(query_id)
+    except Exception as e:
+      self._resolve(query_id, future, error=e)
+      return
+    if conn.is_still_running(status):
+      return
+    with self._lock:
+      self._pending.pop(query_id, None)
+    self._fetcher.submit(self._fetch, query_id, future)
+
+  def _fetch(self, query_id, future):
+    try:
+      with self._pool.connection() as conn:
+        cursor = conn.cursor(DictCursor)
+        cursor.get_results_from_sfqid(query_id)
+        results = self._fetch_results(cursor)
+    except Exception as e:
+      self._resolve(query_id, future, error=e)
+    else:
+      self._resolve(query_id, future, results=results)
+
+  def _resolve(self, query_id, future, results=None, error=None):
+    with self._lock:
+      self._pending.pop(query_id, None)
+    if not future.set_running_or_notify_cancel():
+      return
+    if error is not None:
+      future.set_exception(error)
+    else:
+      future.set_result(results)
@@ -0,0 +1,103 @@
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+from snowflake.connector.errors import DatabaseError
+
+# Snowflake error codes meaning the session behind a connection is gone and
+# the connection has to be replaced rather than reused.
+SESSION_EXPIRED_ERRNOS = {
+  390111,  # session no longer exists
+  390112,  # session no longer exists, new login required
+  390114,  # authentication token has expired
+}
+
+
+def is_session_expired(error):
+  return isinstance(error, DatabaseError) and error.errno in SESSION_EXPIRED_ERRNOS
+
+
+class ConnectionPool:
+  """Per-worker pool of Snowflake connections.
+
+  Connections are opened lazily up to ``size`` and handed out one per thread
+  through ``connection()``. Idle connections are pinged with ``SELECT 1``
+  before reuse once they have sat unused for ``healthcheck_interval`` seconds,
+  and connections whose session has expired are dropped instead of being
+  returned to the pool.
+  """
+
+  def __init__(self, connect, size=4, timeout=30, healthcheck_interval=300):
+    self._connect = connect
+    self.size = size
+    self.timeout = timeout
+    self.healthcheck_interval = healthcheck_interval
+    self._reset()
+
+  def _reset(self):
+    self._pid = os.getpid()
+    self._idle = queue.LifoQueue()
+    self._slots = threading.BoundedSemaphore(self.size)
+
+  def _check_fork(self):
+    # Connections must never be shared between gunicorn workers, so a pool
+    # inherited across a fork starts over empty in the child.
+    if self._pid != os.getpid():
+      self._reset()
+
+  def _is_healthy(self, conn, last_used):
+    if conn.is_closed():
+      return False
+    if time.monotonic() - last_used < self.healthcheck_interval:
+      return True
+    try:
+      conn.cursor().execute('SELECT 1').fetchall()
+      return True
+    except Exception:
+      return False
+
+  def _checkout(self):
+    while True:
+      try:
+        conn, last_used = self._idle.get_nowait()
+      except queue.Empty:
+        return self._connect()
+      if self._is_healthy(conn, last_used):
+        return conn
+      self._close(conn)
+
+  def _close(self, conn):
+    try:
+      conn.close()
+    except Exception:
+      pass
+
+  @contextmanager
+  def connection(self):
+    self._check_fork()
+    if not self._slots.acquire(timeout=self.timeout):
+      raise TimeoutError(
+        f"Timed out after {self.timeout}s waiting for a Snowflake connection")
+    conn = None
+    try:
+      conn = self._checkout()
+      yield conn
+    except Exception as e:
+      if conn is not None and (is_session_expired(e) or conn.is_closed()):
+        self._close(conn)
+        conn = None
+      raise
+    finally:
+      if conn is not None:
+        self._idle.put((conn, time.monotonic()))
+      self._slots.release()
+
+  def close_all(self):
+    while True:
+      try:
+        conn, _ = self._idle.get_nowait()
+      except queue.Empty:
+        return
+      self._close(conn)
@@ -0,0 +1,244 @@
+import datetime
+import heapq
+import threading
+import time
+from collections import defaultdict
+from itertools import repeat
+
+# Columns holding the period a metric row belongs to, in order of preference.
+DATE_COLUMNS = ('DATE', 'DAY')
+# Columns splitting a table into series that advance independently.
+SERIES_COLUMNS = ('CHAIN', 'TIMEFRAME')
+
+
+class Table:
+  """Column-oriented copy of a whole metric table, filtered in-process.
+
+  Equality filters are answered from hash indexes built on first use for
+  each combination of filter columns, so slicing out one chain/timeframe
+  does not scan the table.
+  """
+
+  def __init__(self, columns, data, full_at=0):
+    self.columns = columns
+    self.data = data
+    self.size = len(data[columns[0]]) if columns else 0
+    # When the table was last fetched in full rather than merged into.
+    self.full_at = full_at
+    self._indexes = {}
+
+  @classmethod
+  def from_rows(cls, rows):
+    columns = list(rows[0]) if rows else []
+    return cls(columns, {
+      column: [row[column] for row in rows] for column in columns
+    })
+
+  def _index(self, names):
+    index = self._indexes.get(names)
+    if index is None:
+      index = {}
+      for i, key in enumerate(zip(*(self.data[name] for name in names))):
+        index.setdefault(key, []).append(i)
+      self._indexes[names] = index
+    return index
+
+  @property
+  def date_column(self):
+    return next((name for name in DATE_COLUMNS if name in self.data), None)
+
+  def watermark(self, horizon=None):
+    """Returns the start of the oldest still-open period, if any.
+
+    That is the earliest of the latest dates per CHAIN and TIMEFRAME: a
+    month row may still change while newer week rows exist, and one chain's
+    rows may land later than another's. With ``horizon`` seconds, series
+    trailing the newest one of their TIMEFRAME by more than that are left
+    out, so a chain that stopped loading doesn't hold the watermark back;
+    full fetches still pick up anything they get.
+    """
+    column = self.date_column
+    if column is None:
+      return None
+    latest = {}
+    series_columns = [name for name in SERIES_COLUMNS if name in self.data]
+    keys = (zip(*(self.data[name] for name in series_columns))
+            if series_columns else repeat(()))
+    for series, value in zip(keys, self.data[column]):
+      if value is not None and (series not in latest or value > latest[series]):
+        latest[series] = value
+    if horizon is not None and latest:
+      timeframe = (series_columns.index('TIMEFRAME')
+                   if 'TIMEFRAME' in series_columns else None)
+
+      def group(series):
+        return None if timeframe is None else series[timeframe]
+
+      newest = {}
+      for series, value in latest.items():
+        newest[group(series)] = max(newest.get(group(series), value), value)
+      horizon = datetime.timedelta(seconds=horizon)
+      latest = {series: value for series, value in latest.items()
+                if _as_date(newest[group(series)]) - _as_date(value) <= horizon}
+    return min(latest.values()) if latest else None
+
+  def distinct(self, names):
+    """Returns the set of value tuples found in the ``names`` columns."""
+    names = tuple(names)
+    if not all(name in self.data for name in names):
+      return set()
+    return self._index(names).keys()
+
+  def merge(self, update, since):
+    """Replaces the rows dated ``since`` or later with those of ``update``.
+
+    Returns None when ``update`` has different columns.
+    """
+    if update.size and update.columns != self.columns:
+      return None
+    dates = self.data[self.date_column]
+    keep = [i for i, value in enumerate(dates)
+            if value is None or value < since]
+    return Table(self.columns, {
+      column: [values[i] for i in keep] + update.data.get(column, [])
+      for column, values in self.data.items()
+    }, self.full_at)
+
+  def select(self, columns=None, where=None, order_by=(), descending=False):
+    """Returns matching rows as dicts, like a DictCursor would.
+
+    ``order_by`` sorts with NULLs last ascending and first descending, as
+    Snowflake does by default.
+    """
+    if not self.size:
+      return []
+    rows = self._matching(where)
+    if order_by:
+      keys = [self.data[name] for name in order_by]
+      rows = sorted(rows,
+                    key=lambda i: tuple((key[i] is None, key[i]) for key in keys),
+                    reverse=descending)
+    return self._rows(rows, columns)
+
+  def count(self, where=None):
+    return len(self._matching(where)) if self.size else 0
+
+  def page(self, columns, where, value, label, limit=None, after=None):
+    """Returns matching rows ranked by ``value`` descending, then ``label``.
+
+    ``after`` is the ``(value, label)`` of the last row of the previous
+    page; only rows ranked below it are returned, at most ``limit`` of them.
+    Only the rows returned are built.
+    """
+    if not self.size:
+      return []
+    values, labels = self.data[value], self.data[label]
+
+    def rank(v, name):
+      # NULL values first, as ORDER BY ... DESC does in Snowflake.
+      return (v is not None, -v if v is not None else 0, name is None,
+              name or '')
+
+    keys = {i: rank(values[i], labels[i]) for i in self._matching(where)}
+    rows = keys
+    if after is not None:
+      start = rank(*after)
+      rows = [i for i in keys if keys[i] > start]
+    if limit is None:
+      rows = sorted(rows, key=keys.__getitem__)
+    else:
+      rows = heapq.nsmallest(limit, rows, key=keys.__getitem__)
+    return self._rows(rows, columns)
+
+  def _matching(self, where):
+    where = where or {}
+    names = tuple(sorted(where))
+    if names:
+      return self._index(names).get(tuple(where[name] for name in names), [])
+    return range(self.size)
+
+  def _rows(self, rows, columns=None):
+    columns = columns or self.columns
+    data = [(column, self.data[column]) for column in columns]
+    return [{column: values[i] for column, values in data} for i in rows]
+
+
+class TableCache:
+  """Keeps whole metric tables in worker memory, backed by Redis.
+
+  ``fetch(name)`` loads a whole table as a ``Table``. Tables are cached
+  under the version ``version_of(table)`` reports (its LAST_ALTERED once
+  `refresh-changed` has recorded it), so a changed table is fetched again as
+  soon as its new version is known, and otherwise after ``ttl`` seconds.
+  Concurrent requests for the same table in one worker share a single fetch.
+
+  Time series are refetched incrementally: when a worker still holds an
+  older copy of a table with a DATE (or DAY) column, only rows from its
+  oldest open period on are fetched with ``fetch(name, since, column)`` and
+  merged in. A full fetch is done at least every ``full_refresh`` seconds to pick
+  up restated history.
+  """
+
+  def __init__(self, cache, fetch, version_of, ttl=3600, local_ttl=300,
+               full_refresh=86400):
+    self.cache = cache
+    self.fetch = fetch
+    self.version_of = version_of
+    self.ttl = ttl
+    self.local_ttl = min(local_ttl, ttl)
+    self.full_refresh = full_refresh
+    self._tables = {}
+    self._locks = defaultdict(threading.Lock)
+
+  def get(self, name):
+    key = f"table:{name}:{self.version_of(name)}"
+    table = self._get_local(name, key)
+    if table is not None:
+      return table
+    with self._locks[name]:
+      table = self._get_local(name, key)
+      if table is not None:
+        return table
+      stored = self.cache.get(key)
+      if stored is not None:
+        table = Table(stored['columns'], stored['data'],
+                      stored.get('full_at', 0))
+      else:
+        table = self._fetch(name)
+        self.cache.set(key, {'columns': table.columns, 'data': table.data,
+                             'full_at': table.full_at},
+                       timeout=self.ttl)
+      self._tables[name] = (key, time.time() + self.local_ttl, table)
+      return table
+
+  def _fetch(self, name):
+    item = self._tables.get(name)
+    previous = item[2] if item else None
+    if (previous is not None
+        and time.time() - previous.full_at < self.full_refresh):
+      since = previous.watermark(horizon=self.full_refresh)
+      if since is not None:
+        update = self.fetch(name, since=since, column=previous.date_column)
+        table = previous.merge(update, since)
+        if table is not None:
+          return table
+    table = self.fetch(name)
+    table.full_at = time.time()
+    return table
+
+  def _get_local(self, name, key):
+    item = self._tables.get(name)
+    if item is None:
+      return None
+    stored_key, expires, table = item
+    if stored_key != key or expires <= time.time():
+      return None
+    return table
+
+
+def _as_date(value):
+  if isinstance(value, datetime.datetime):
+    return value.date()
+  if isinstance(value, str):
+    return datetime.date.fromisoformat(value[:10])
+  return value
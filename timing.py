@@ -0,0 +1,73 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+_current = contextvars.ContextVar('timings', default=None)
+
+
+class Timings:
+  """Durations of the phases of one request, summed per phase name.
+
+  Phases may be recorded from query threads running concurrently, so a
+  phase can add up to more than the request's wall time.
+  """
+
+  def __init__(self):
+    self.start = time.perf_counter()
+    self.phases = {}
+    self._lock = threading.Lock()
+
+  def add(self, name, seconds):
+    with self._lock:
+      total, count = self.phases.get(name, (0.0, 0))
+      self.phases[name] = (total + seconds, count + 1)
+
+  def get(self, name):
+    return self.phases.get(name, (0.0, 0))[0]
+
+  def total(self):
+    return time.perf_counter() - self.start
+
+  def header(self):
+    """Renders the phases as a Server-Timing header value."""
+    entries = []
+    for name, (seconds, count) in self.phases.items():
+      entry = f"{name};dur={seconds * 1000:.1f}"
+      if count > 1:
+        entry += f';desc="{count}x"'
+      entries.append(entry)
+    return ', '.join(entries)
+
+
+def start():
+  timings = Timings()
+  _current.set(timings)
+  return timings
+
+
+def stop():
+  _current.set(None)
+
+
+def current():
+  return _current.get()
+
+
+def record(name, seconds):
+  timings = _current.get()
+  if timings is not None:
+    timings.add(name, seconds)
+
+
+@contextmanager
+def phase(name):
+  timings = _current.get()
+  if timings is None:
+    yield
+    return
+  start = time.perf_counter()
+  try:
+    yield
+  finally:
+    timings.add(name, time.perf_counter() - start)
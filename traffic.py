@@ -0,0 +1,30 @@
+import json
+import os
+import random
+import threading
+
+
+class TrafficCapture:
+  """Appends a random sample of requests to a JSONL file for replay.
+
+  Each line is small and written with a single append, so the workers of
+  one host can share a file. The file is reopened after a fork.
+  """
+
+  def __init__(self, path, sample_rate=0.1):
+    self.path = path
+    self.sample_rate = sample_rate
+    self._lock = threading.Lock()
+    self._pid = None
+    self._file = None
+
+  def sampled(self):
+    return random.random() < self.sample_rate
+
+  def record(self, entry):
+    line = json.dumps(entry, separators=(',', ':'), default=str) + '\n'
+    with self._lock:
+      if self._pid != os.getpid():
+        self._file = open(self.path, 'a', buffering=1)
+        self._pid = os.getpid()
+      self._file.write(line)